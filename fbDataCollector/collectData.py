@@ -4,12 +4,35 @@
 #
 #  Outputs an anonymized, well-formed XML document that represents all relevant "interest data" of your Facebook friends.  
 #
+#  Friends can be fetched concurrently (--workers N); each friend's <user> record is built in memory and written out
+#  in one piece, in friend-list order unless --unordered is given.
+#
 
+import os
+import sys
+import time
+import tempfile
+import random
+import socket
+import urllib2
+import httplib
+import argparse
 import facebook
 import fbAuth
 import md5
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
 from xml.sax.saxutils import escape		
 
+# Facebook error codes for "too many calls": application, user, and per-hour limits
+RATE_LIMIT_ERRORS = set([4, 17, 341, 613])
+
+# Facebook error codes for failures that go away by themselves: "unknown error" and "service temporarily unavailable"
+TRANSIENT_ERRORS = set([1, 2])
+
+# Most ids one batched request asks for: the Graph API caps ?ids= lists at 50, and long FQL IN lists get rejected
+MAX_BATCH = 50
+
 
 def oneWayHash(str):
 	m = md5.new()
@@ -38,43 +61,300 @@ def print_xml_safe_array(dict, key, subkey, label,output):
 
 	output.write("\t\t<%s>%s</%s>\n" % (label, escape(val.encode('utf-8')), label))
 
-if __name__ == "__main__":
-	graphApi = facebook.GraphAPI(fbAuth.get_token())
+def errorCode(error):
+	# The error code of a GraphAPIError: FQL's error_code, or the code of a Graph API error object
+	result = error.result if isinstance(error.result, dict) else {}
+	code = result.get("error_code")
+	if isinstance(result.get("error"), dict):
+		code = result["error"].get("code", code)
+	return code
 
-	friends = graphApi.get_connections("me", "friends")
-	outFile = open("friendData.xml", "w+")
+def isRateLimited(error):
+	return errorCode(error) in RATE_LIMIT_ERRORS
 
-	outFile.write("<?xml version=\"1.0\"?>\n")
-	outFile.write("<users>\n")
+def isTransient(error):
+	return errorCode(error) in RATE_LIMIT_ERRORS or errorCode(error) in TRANSIENT_ERRORS
 
-	# Loop through all my friends
-	for friend in friends['data']:
+def withBackoff(call, retries=6, delay=1.0):
+	# Retry calls that were rate limited or hit a transient API or network error, backing off exponentially (with jitter)
+	for attempt in xrange(retries):
+		try:
+			return call()
+		except facebook.GraphAPIError, e:
+			if not isTransient(e) or attempt == retries - 1:
+				raise
+		except (urllib2.URLError, httplib.HTTPException, socket.error), e:
+			if attempt == retries - 1:
+				raise
+		time.sleep(delay * (2 ** attempt) * (1 + random.random()))
 
-		# Create a one-way hash of the Facebook user ID to anonymize the data
-		outFile.write("\t<user id=\"%s\">\n" % (oneWayHash(friend["id"])))
+INTERESTS_FIELDS = "about_me, activities, interests, music, movies, tv, books, quotes, sports"
 
-		# Retrieve the friend's user object to get information such as gender, locale, etc...
-		friendProfileInfo = graphApi.get_object(friend["id"])
+def userRecord(friendId, friendProfileInfo, userInterests):
+	# Returns the complete <user> record of one friend, given his user object and FQL interests row
+	output = StringIO()
 
-		print_xml_safe(friendProfileInfo, "gender", "gender", outFile)
-		print_xml_safe(friendProfileInfo, "locale", "locale", outFile)
-		print_xml_safe_array(friendProfileInfo, "favorite_athletes", "name", "athletes", outFile)
-		print_xml_safe_array(friendProfileInfo, "favorite_teams", "name", "teams", outFile)
+	# Create a one-way hash of the Facebook user ID to anonymize the data
+	output.write("\t<user id=\"%s\">\n" % (oneWayHash(friendId)))
 
-		# Perform a FQL query to retrieve relevant data on what interests each person...        
-	        result = graphApi.fql("SELECT about_me, activities, interests, music, movies, tv, books, quotes, sports FROM user WHERE uid = %s" % (friend['id']))
+	print_xml_safe(friendProfileInfo, "gender", "gender", output)
+	print_xml_safe(friendProfileInfo, "locale", "locale", output)
+	print_xml_safe_array(friendProfileInfo, "favorite_athletes", "name", "athletes", output)
+	print_xml_safe_array(friendProfileInfo, "favorite_teams", "name", "teams", output)
+
+	print_xml_safe(userInterests, "about_me", "about", output)
+	print_xml_safe(userInterests, "tv", "tv", output)
+	print_xml_safe(userInterests, "movies", "movies", output)
+	print_xml_safe(userInterests, "music", "music", output)
+	print_xml_safe(userInterests, "books", "books", output)	
+	print_xml_safe(userInterests, "interests", "interests", output)
+	print_xml_safe_array(userInterests, "sports", "name", "sports", output)
+	output.write("\t</user>\n")
+	return output.getvalue()
+
+def friendRecord(graphApi, friend):
+	# Retrieve the friend's user object to get information such as gender, locale, etc...
+	friendProfileInfo = withBackoff(lambda: graphApi.get_object(friend["id"]))
+
+	# Perform a FQL query to retrieve relevant data on what interests each person...        
+	result = withBackoff(lambda: graphApi.fql("SELECT %s FROM user WHERE uid = %s" % (INTERESTS_FIELDS, friend['id'])))
+	if not result:
+		print >> sys.stderr, "no interests returned for friend %s" % friend["id"]
+		result = [{}]
 		
-		# Somewhat valid assumption that FB UID's are, indeed, unique, and that FB doesn't lie...
-		userInterests = result[0]
-
-		print_xml_safe(userInterests, "about_me", "about", outFile)
-		print_xml_safe(userInterests, "tv", "tv", outFile)
-		print_xml_safe(userInterests, "movies", "movies", outFile)
-		print_xml_safe(userInterests, "music", "music", outFile)
-		print_xml_safe(userInterests, "books", "books", outFile)	
-		print_xml_safe(userInterests, "interests", "interests", outFile)
-		print_xml_safe_array(userInterests, "sports", "name", "sports", outFile)
-		outFile.write("\t</user>\n")
+	# Somewhat valid assumption that FB UID's are, indeed, unique, and that FB doesn't lie...
+	return userRecord(friend["id"], friendProfileInfo, result[0])
+
+def friendRecords(graphApi, friends):
+	# Same as friendRecord, for a whole batch of friends in two round trips: one Graph API call for all
+	# the user objects (?ids=...), and one FQL query for all the interests, split back up by uid
+	ids = [friend["id"] for friend in friends]
+	friendProfileInfo = withBackoff(lambda: graphApi.get_objects(ids))
+	result = withBackoff(lambda: graphApi.fql("SELECT uid, %s FROM user WHERE uid IN (%s)" % (INTERESTS_FIELDS, ",".join(ids))))
+	userInterests = dict((str(row["uid"]), row) for row in result)
+	# A friend left out of either response is fetched again on his own, rather than written out as all N/A
+	records = []
+	for friend in friends:
+		id = friend["id"]
+		if id in friendProfileInfo and id in userInterests:
+			records.append(userRecord(id, friendProfileInfo[id], userInterests[id]))
+		else:
+			print >> sys.stderr, "friend %s missing from a batched response, fetching him alone" % id
+			records.append(friendRecord(graphApi, friend))
+	return records
+
+def fetchBatch(graphApi, batch, skipErrors=False):
+	# The (friend, record) pairs of a batch of friends. With skipErrors, a friend that fails with a Graph API error
+	# that retrying does not fix comes with the error in place of his record; a batch that fails is refetched one
+	# friend at a time, so that one bad friend does not take the others down with him
+	try:
+		if len(batch) > 1:
+			return zip(batch, friendRecords(graphApi, batch))
+		return [(batch[0], friendRecord(graphApi, batch[0]))]
+	except facebook.GraphAPIError, e:
+		if not skipErrors or isRateLimited(e):
+			raise
+		if len(batch) > 1:
+			return [pair for friend in batch for pair in fetchBatch(graphApi, [friend], skipErrors)]
+		return [(batch[0], e)]
 
+def fetchRecords(graphApi, friends, workers=1, ordered=True, batchSize=1, skipErrors=False):
+	# Fetch up to 'workers' friends (or batches of batchSize friends, at most MAX_BATCH) at a time, yielding
+	# (friend, record) pairs
+	batchSize = max(1, min(batchSize, MAX_BATCH))
+	batches = [friends[i:i + batchSize] for i in xrange(0, len(friends), batchSize)]
+	pool = ThreadPool(workers)
+	completed = False
+	try:
+		fetch = pool.imap if ordered else pool.imap_unordered
+		for records in fetch(lambda batch: fetchBatch(graphApi, batch, skipErrors), batches):
+			for (friend, record) in records:
+				yield friend, record
+		completed = True
+	finally:
+		if completed:
+			pool.close()
+			pool.join()
+		else:
+			# A fetch failed (or the caller stopped early): drop the friends still queued rather than fetch
+			# records that nobody will write, from an API that may be refusing us already
+			pool.terminate()
+
+def collect(graphApi, friends, outFile, workers=1, ordered=True, batchSize=1):
+	# Records are written out whole, as they complete
+	outFile.write("<?xml version=\"1.0\"?>\n")
+	outFile.write("<users>\n")
+	for (friend, record) in fetchRecords(graphApi, friends, workers, ordered, batchSize):
+		outFile.write(record)
 	outFile.write("</users>")
 
+class Checkpoint(object):
+	# Completed <user> records are appended to <output>.records, and indexed in <output>.checkpoint by one line
+	# per record: hashed user id, time collected, offset and length in the records file. A record counts as done
+	# only once its index line is on disk, so a crawl that dies midway loses at most the records in flight.
+	# A friend who could not be fetched at all gets a line with "failed" and the error in place of offset and length;
+	# that does not make him done, it only tells the next run what went wrong.
+
+	def __init__(self, output):
+		self.recordsPath = output + ".records"
+		self.indexPath = output + ".checkpoint"
+		self._recover()
+		self.entries = {}
+		self.failures = {}
+		if os.path.exists(self.indexPath):
+			for line in open(self.indexPath, "rb"):
+				fields = line.rstrip("\n").split("\t")
+				if not line.endswith("\n") or len(fields) != 4:
+					break # torn final line
+				if fields[2] == "failed":
+					self.failures[fields[0]] = (float(fields[1]), fields[3])
+				else:
+					self.entries[fields[0]] = (float(fields[1]), int(fields[2]), int(fields[3]))
+					self.failures.pop(fields[0], None)
+		end = max([offset + length for (collected, offset, length) in self.entries.values()] or [0])
+
+		# Drop whatever was written after the last checkpointed record, and rewrite the index without a torn line;
+		# if refreshed records have left older copies behind, drop those too
+		self.records = open(self.recordsPath, "a+b")
+		self.records.truncate(end)
+		if sum(length for (collected, offset, length) in self.entries.values()) < end:
+			self._compact()
+		else:
+			self._replace(self.indexPath, self._indexData())
+		self.index = open(self.indexPath, "ab")
+
+	def _indexData(self):
+		lines = ["%s\t%r\t%d\t%d\n" % ((id,) + entry) for (id, entry) in self.entries.items()]
+		lines.extend("%s\t%r\tfailed\t%s\n" % ((id,) + entry) for (id, entry) in self.failures.items())
+		return "".join(lines)
+
+	def _compact(self):
+		# Rewrite the records file with only the latest record of each user, and the index to match. Both are
+		# written next to the originals and then renamed over them, records first (see _recover)
+		parts = []
+		entries = {}
+		end = 0
+		for (id, (collected, offset, length)) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+			self.records.seek(offset)
+			parts.append(self.records.read(length))
+			entries[id] = (collected, end, length)
+			end += length
+		self.entries = entries
+		self._replace(self.recordsPath + ".new", "".join(parts))
+		self._replace(self.indexPath + ".new", self._indexData())
+		self.records.close()
+		os.rename(self.recordsPath + ".new", self.recordsPath)
+		os.rename(self.indexPath + ".new", self.indexPath)
+		self.records = open(self.recordsPath, "a+b")
+
+	def _recover(self):
+		# Finish or roll back a compaction that was cut short: once the new records file has been renamed into
+		# place, only the new index matches it; before that, the old files are still consistent
+		newRecords, newIndex = self.recordsPath + ".new", self.indexPath + ".new"
+		if os.path.exists(newIndex) and not os.path.exists(newRecords):
+			os.rename(newIndex, self.indexPath)
+		for path in (newRecords, newIndex):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def _replace(self, path, data):
+		fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(tmpPath, path)
+
+	def isFresh(self, userId, maxAge=None):
+		# Whether the user has a record collected less than maxAge seconds ago (a failure does not count)
+		if userId not in self.entries:
+			return False
+		return maxAge is None or time.time() - self.entries[userId][0] <= maxAge
+
+	def append(self, userId, record):
+		self.records.seek(0, os.SEEK_END)
+		offset = self.records.tell()
+		self.records.write(record)
+		self.records.flush()
+		os.fsync(self.records.fileno())
+		entry = (time.time(), offset, len(record))
+		self.index.write("%s\t%r\t%d\t%d\n" % ((userId,) + entry))
+		self.index.flush()
+		os.fsync(self.index.fileno())
+		self.entries[userId] = entry
+		self.failures.pop(userId, None)
+
+	def fail(self, userId, error):
+		# Record that the user could not be fetched this time; resuming tries him again
+		entry = (time.time(), " ".join(unicode(error).split()).encode("utf-8") or "error")
+		self.index.write("%s\t%r\tfailed\t%s\n" % ((userId,) + entry))
+		self.index.flush()
+		os.fsync(self.index.fileno())
+		self.failures[userId] = entry
+
+	def write(self, output, userIds):
+		# Assemble the (latest) records of the given users into the XML document, replacing output atomically
+		parts = ["<?xml version=\"1.0\"?>\n", "<users>\n"]
+		for userId in userIds:
+			if userId in self.entries:
+				(collected, offset, length) = self.entries[userId]
+				self.records.seek(offset)
+				parts.append(self.records.read(length))
+		parts.append("</users>")
+		self._replace(output, "".join(parts))
+
+	def close(self):
+		self.records.close()
+		self.index.close()
+
+def crawl(graphApi, friends, output, workers=1, ordered=True, batchSize=1, maxAge=None):
+	# Resumable collection: only friends without a checkpointed record, or whose record is older than maxAge
+	# seconds, are fetched; output is written once every friend has a record. A friend the Graph API keeps
+	# refusing (other than for rate limits) is checkpointed as failed and left out of this run's output, instead
+	# of stopping the crawl; the next --resume fetches him again
+	checkpoint = Checkpoint(output)
+	try:
+		pending = [friend for friend in friends if not checkpoint.isFresh(oneWayHash(friend["id"]), maxAge)]
+		print >> sys.stderr, "%d of %d friends to fetch" % (len(pending), len(friends))
+		for (friend, record) in fetchRecords(graphApi, pending, workers, ordered, batchSize, skipErrors=True):
+			if isinstance(record, facebook.GraphAPIError):
+				checkpoint.fail(oneWayHash(friend["id"]), record)
+				print >> sys.stderr, "skipping friend %s: %s" % (friend["id"], checkpoint.failures[oneWayHash(friend["id"])][1])
+			else:
+				checkpoint.append(oneWayHash(friend["id"]), record)
+		failed = [friend for friend in friends if oneWayHash(friend["id"]) in checkpoint.failures]
+		if failed:
+			print >> sys.stderr, "%d friends could not be fetched; --resume tries them again" % len(failed)
+		checkpoint.write(output, [oneWayHash(friend["id"]) for friend in friends])
+	finally:
+		checkpoint.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog="collectData.py")
+	parser.add_argument("--workers", type=int, default=1, help="number of friends fetched concurrently")
+	parser.add_argument("--unordered", action="store_true", help="write records as they complete, not in friend-list order")
+	parser.add_argument("--batch", type=int, default=1, help="friends fetched per request (batched Graph API and FQL calls, at most %d)" % MAX_BATCH)
+	parser.add_argument("--output", default="friendData.xml", help="output file")
+	parser.add_argument("--cache", metavar="DIR", help="cache responses in DIR, so that re-runs only fetch what has expired")
+	parser.add_argument("--cache-ttl", type=int, default=86400, help="seconds a cached profile stays fresh")
+	parser.add_argument("--resume", action="store_true", help="checkpoint records as they are collected, and resume from the last checkpoint")
+	parser.add_argument("--max-age", type=int, help="with --resume, refetch friends whose record is older than this many seconds")
+	args = parser.parse_args()
+	if args.batch > MAX_BATCH:
+		print >> sys.stderr, "--batch %d is more than one request can ask for; using %d" % (args.batch, MAX_BATCH)
+
+	cache = None
+	if args.cache:
+		# The friend list itself is always refetched, to pick up new friends
+		cache = facebook.ResponseCache(args.cache, ttl=args.cache_ttl, ttls={"connections": 0})
+	graphApi = facebook.GraphAPI(fbAuth.get_token(), cache=cache)
+
+	friends = graphApi.get_connections("me", "friends")
+
+	# Loop through all my friends
+	if args.resume:
+		crawl(graphApi, friends['data'], args.output, args.workers, not args.unordered, args.batch, args.max_age)
+	else:
+		outFile = open(args.output, "w+")
+		collect(graphApi, friends['data'], outFile, args.workers, not args.unordered, args.batch)
+		outFile.close()
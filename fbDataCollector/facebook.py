@@ -43,6 +43,14 @@ import hmac
 import base64
 import logging
 import socket
+import threading
+import Queue
+import urlparse
+import os
+import tempfile
+import cPickle
+from collections import OrderedDict
+from cStringIO import StringIO
 
 # Find a JSON parser
 try:
@@ -61,6 +69,290 @@ except ImportError:
     from cgi import parse_qs
 
 
+class HTTPResponse(object):
+    """A fully read HTTP response: status code, headers and body."""
+    def __init__(self, status, headers, data, url):
+        self.status = status
+        self.headers = headers  # a mimetools.Message, like urllib2's info()
+        self.data = data
+        self.url = url
+
+
+class HTTPTransport(object):
+    """Sends HTTP(S) requests over a pool of persistent (keep-alive)
+    connections, so that repeated calls to the same host don't pay for a
+    new TCP and TLS handshake each time.
+
+    Up to pool_size idle connections are kept per host; timeout (in
+    seconds) applies to connecting and to every read. The transport is
+    safe to share between threads.
+
+    Any object with a compatible request() method can be passed to
+    GraphAPI instead, e.g. to serve canned responses in tests.
+
+    """
+    def __init__(self, pool_size=10, timeout=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme, netloc):
+        with self._lock:
+            if (scheme, netloc) not in self._pools:
+                self._pools[(scheme, netloc)] = Queue.Queue(self.pool_size)
+            return self._pools[(scheme, netloc)]
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, method, url, body=None, headers=None):
+        """Sends the request and returns an HTTPResponse, whatever its
+        status code.
+        """
+        parts = urlparse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        pool = self._pool(parts.scheme, parts.netloc)
+        while True:
+            try:
+                conn, reused = pool.get_nowait(), True
+            except Queue.Empty:
+                conn, reused = self._connect(parts.scheme, parts.netloc), False
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and method in ("GET", "HEAD"):
+                    # The server may have dropped an idle connection; retry
+                    # on another one. Not for a POST, which the server may
+                    # already have acted on.
+                    continue
+                raise
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                pool.put_nowait(conn)
+            except Queue.Full:
+                conn.close()
+        return HTTPResponse(response.status, response.msg, data, url)
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+class ResponseCache(object):
+    """Caches successful GET responses of the Graph API and FQL.
+
+    Responses are kept in an in-memory LRU of up to max_entries, and, if a
+    directory is given, also on disk (one file per response), so they
+    survive between runs. Entries are keyed on the request URL, i.e. the
+    path, the arguments and the FQL query, and on a hash of the access
+    token, so clients with different tokens never see each other's
+    responses.
+
+    Each entry expires after the TTL (in seconds) of its endpoint: one of
+    "object" (get_object), "connections" (get_connections), "fql" and
+    "api", taken from ttls and defaulting to ttl. An expired entry that
+    came with an ETag or Last-Modified header is revalidated with a
+    conditional request, and reused if the server answers 304.
+
+    Expired files are deleted from the directory when the cache is
+    created and after every max_entries writes; if max_files is given,
+    the oldest files beyond it are deleted too.
+
+    """
+    ENDPOINTS = ("object", "connections", "fql", "api")
+
+    def __init__(self, directory=None, max_entries=10000, ttl=86400,
+                 ttls=None, max_files=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.prune()
+
+    def key(self, url):
+        # The file name of a disk entry; it starts with the endpoint so that
+        # prune() can tell its TTL without reading it.
+        parts = urlparse.urlsplit(url)
+        args = urlparse.parse_qsl(parts.query, True)
+        token = "".join(v for (k, v) in args if k == "access_token")
+        args = [(k, v) for (k, v) in args if k != "access_token"]
+        return self.endpoint(url) + "-" + hashlib.sha1(
+            parts.netloc + parts.path + "?" + urllib.urlencode(sorted(args)) +
+            "#" + hashlib.sha1(token).hexdigest()).hexdigest()
+
+    def endpoint(self, url):
+        path = urlparse.urlsplit(url).path.strip("/")
+        if "method/" in path:
+            return "fql" if path.rsplit("/", 1)[-1].startswith("fql.") \
+                else "api"
+        return "connections" if "/" in path else "object"
+
+    def expired(self, url, entry):
+        ttl = self.ttls.get(self.endpoint(url), self.ttl)
+        return time.time() - entry["time"] > ttl
+
+    def prune(self):
+        """Delete the files of expired entries from the directory, and then
+        the oldest ones beyond max_files. A file is as old as the last
+        write of its entry. Expired entries that can be revalidated, and
+        files that are not entries (e.g. ones left by an older version, or
+        a write that never finished), are kept for the longest TTL.
+        """
+        now = time.time()
+        longest = max([self.ttl] + self.ttls.values())
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue # deleted by another process meanwhile
+            endpoint = name.split("-", 1)[0]
+            if endpoint in self.ENDPOINTS:
+                ttl = self.ttls.get(endpoint, self.ttl)
+            else:
+                ttl = longest
+            age = now - mtime
+            if age > ttl and (age > longest or not self._revalidatable(path)):
+                self._discard(name, path)
+            else:
+                files.append((mtime, name, path))
+        if self.max_files is not None and len(files) > self.max_files:
+            files.sort()
+            for (mtime, name, path) in files[:len(files) - self.max_files]:
+                self._discard(name, path)
+
+    def _revalidatable(self, path):
+        try:
+            with open(path, "rb") as f:
+                entry = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return False
+        return bool(entry.get("etag") or entry.get("last_modified"))
+
+    def _discard(self, key, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                return entry
+        if self.directory:
+            try:
+                with open(os.path.join(self.directory, key), "rb") as f:
+                    entry = cPickle.load(f)
+            except (IOError, EOFError, cPickle.UnpicklingError):
+                return None
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.directory:
+            # Write to a temporary file first, so readers never see half an
+            # entry.
+            fd, path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(path, os.path.join(self.directory, key))
+            with self._lock:
+                self._writes += 1
+                due = self._writes % self.max_entries == 0
+            if due:
+                self.prune()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachingTransport(object):
+    """Wraps a transport (e.g. an HTTPTransport) with a ResponseCache.
+    Only GET requests are cached.
+    """
+    def __init__(self, transport, cache):
+        self.transport = transport
+        self.cache = cache
+
+    def request(self, method, url, body=None, headers=None):
+        if method != "GET":
+            return self.transport.request(method, url, body, headers)
+        key = self.cache.key(url)
+        entry = self.cache.get(key)
+        headers = dict(headers or {})
+        if entry is not None:
+            if not self.cache.expired(url, entry):
+                return self._response(entry, url)
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.transport.request(method, url, body, headers)
+        if response.status == 304 and entry is not None:
+            entry = dict(entry, time=time.time())
+            self.cache.put(key, entry)
+            return self._response(entry, url)
+        if response.status == 200 and self._cacheable(response):
+            self.cache.put(key, {
+                "time": time.time(),
+                "headers": str(response.headers),
+                "data": response.data,
+                "etag": response.headers.getheader("etag"),
+                "last_modified": response.headers.getheader("last-modified"),
+            })
+        return response
+
+    def _cacheable(self, response):
+        """Graph API and FQL errors (rate limits, for one) come back with
+        status 200 too; only successful results may be cached, or every
+        retry would be answered with the same error until it expires.
+        """
+        if response.headers.maintype != "text":
+            return True
+        try:
+            result = _parse_json(response.data)
+        except ValueError:
+            return False
+        return not (isinstance(result, dict) and
+                    (result.get("error") or "error_code" in result))
+
+    def _response(self, entry, url):
+        return HTTPResponse(200, httplib.HTTPMessage(StringIO(entry["headers"])),
+                            entry["data"], url)
+
+
 class GraphAPI(object):
     """A client for the Facebook Graph API.
 
@@ -89,10 +381,49 @@ class GraphAPI(object):
     get_user_from_cookie() method below to get the OAuth access token
     for the active user from the cookie saved by the SDK.
 
+    All requests go through a shared HTTPTransport, which keeps up to
+    pool_size connections per host alive between calls. A different
+    transport, or different graph_url and api_url endpoints (e.g. a local
+    mock server), can be passed in. If a ResponseCache is given, GET
+    requests are answered from it while fresh.
+
     """
-    def __init__(self, access_token=None, timeout=None):
+    graph_url = "https://graph.facebook.com/"
+    api_url = "https://api.facebook.com/method/"
+
+    def __init__(self, access_token=None, timeout=None, transport=None,
+                 pool_size=10, graph_url=None, api_url=None, cache=None):
         self.access_token = access_token
         self.timeout = timeout
+        self.api_key = None
+        self.transport = transport or HTTPTransport(pool_size, timeout)
+        if cache is not None:
+            self.transport = CachingTransport(self.transport, cache)
+        if graph_url:
+            self.graph_url = graph_url
+        if api_url:
+            self.api_url = api_url
+
+    def _send(self, url, args, post_args):
+        """Sends the request; a server error (5xx) is raised as an
+        urllib2.HTTPError, as urllib2.urlopen would, so that callers can
+        tell it from an API error and retry it.
+        """
+        if post_args is None:
+            response = self.transport.request("GET", url + "?" +
+                                              urllib.urlencode(args))
+        else:
+            response = self.transport.request(
+                "POST", url + "?" + urllib.urlencode(args),
+                urllib.urlencode(post_args),
+                {"Content-Type": "application/x-www-form-urlencoded"})
+        if response.status >= 500:
+            raise urllib2.HTTPError(response.url, response.status,
+                                    httplib.responses.get(response.status,
+                                                          "Server Error"),
+                                    response.headers,
+                                    StringIO(response.data))
+        return response
 
     def get_object(self, id, **args):
         """Fetchs the given object from the graph."""
@@ -289,38 +620,25 @@ class GraphAPI(object):
                 post_args["access_token"] = self.access_token
             else:
                 args["access_token"] = self.access_token
-        post_data = None if post_args is None else urllib.urlencode(post_args)
-        try:
-            file = urllib2.urlopen("https://graph.facebook.com/" + path + "?" +
-                    urllib.urlencode(args), post_data, timeout=self.timeout)
-        except urllib2.HTTPError, e:
-            response = _parse_json(e.read())
-            raise GraphAPIError(response)
-        except TypeError:
-            # Timeout support for Python <2.6
-            if self.timeout:
-                socket.setdefaulttimeout(self.timeout)
-            file = urllib2.urlopen("https://graph.facebook.com/" + path + "?" +
-                                    urllib.urlencode(args), post_data)
-        try:
-            fileInfo = file.info()
-            if fileInfo.maintype == 'text':
-                response = _parse_json(file.read())
-            elif fileInfo.maintype == 'image':
-                mimetype = fileInfo['content-type']
-                response = {
-                    "data": file.read(),
-                    "mime-type": mimetype,
-                    "url": file.url,
-                }
-            else:
-                raise GraphAPIError('Maintype was not text or image')
-        finally:
-            file.close()
-        if response and isinstance(response, dict) and response.get("error"):
-            raise GraphAPIError(response["error"]["type"],
-                                response["error"]["message"])
-        return response
+        response = self._send(self.graph_url + path, args, post_args)
+        if response.status >= 400:
+            # Facebook sends OAuth errors as 400, we want a GraphAPIError
+            raise GraphAPIError(_parse_json(response.data))
+        fileInfo = response.headers
+        if fileInfo.maintype == 'text':
+            result = _parse_json(response.data)
+        elif fileInfo.maintype == 'image':
+            mimetype = fileInfo['content-type']
+            result = {
+                "data": response.data,
+                "mime-type": mimetype,
+                "url": response.url,
+            }
+        else:
+            raise GraphAPIError('Maintype was not text or image')
+        if result and isinstance(result, dict) and result.get("error"):
+            raise GraphAPIError(result)
+        return result
 
     def api_request(self, path, args=None, post_args=None):
         """Fetches the given path in the Graph API.
@@ -345,23 +663,9 @@ class GraphAPI(object):
             post_args["format"] = "json-strings"
         else:
             args["format"] = "json-strings"
-        post_data = None if post_args is None else urllib.urlencode(post_args)
-        try:
-            file = urllib.urlopen("https://api.facebook.com/method/" + path +
-                    "?" + urllib.urlencode(args),
-                    post_data, timeout=self.timeout)
-        except TypeError:
-            # Timeout support for Python <2.6
-            if self.timeout:
-                socket.setdefaulttimeout(self.timeout)
-            file = urllib.urlopen("https://api.facebook.com/method/" + path +
-                    "?" + urllib.urlencode(args), post_data)
-
-        try:
-            response = _parse_json(file.read())
-        finally:
-            file.close()
-        if response and response.get("error"):
+        response = _parse_json(self._send(self.api_url + path, args,
+                                          post_args).data)
+        if response and isinstance(response, dict) and response.get("error"):
             raise GraphAPIError(response)
         return response
 
@@ -377,7 +681,6 @@ class GraphAPI(object):
                 post_args["access_token"] = self.access_token
             else:
                 args["access_token"] = self.access_token
-        post_data = None if post_args is None else urllib.urlencode(post_args)
 
         """Check if query is a dict and
            use the multiquery method
@@ -392,28 +695,11 @@ class GraphAPI(object):
 
         args["format"] = "json"
 
-        try:
-            file = urllib2.urlopen("https://api.facebook.com/method/" +
-                               fql_method + "?" + urllib.urlencode(args),
-                               post_data, timeout=self.timeout)
-        except TypeError:
-            # Timeout support for Python <2.6
-            if self.timeout:
-                socket.setdefaulttimeout(self.timeout)
-            file = urllib2.urlopen("https://api.facebook.com/method/" +
-                           fql_method + "?" + urllib.urlencode(args),
-                           post_data)
-
-        try:
-            content = file.read()
-            response = _parse_json(content)
-            #Return a list if success, return a dictionary if failed
-            if type(response) is dict and "error_code" in response:
-                raise GraphAPIError(response)
-        except Exception, e:
-            raise e
-        finally:
-            file.close()
+        response = _parse_json(self._send(self.api_url + fql_method, args,
+                                          post_args).data)
+        #Return a list if success, return a dictionary if failed
+        if type(response) is dict and "error_code" in response:
+            raise GraphAPIError(response)
 
         return response
 
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# coding: utf-8
+
+#
+#  Tests for the rate limit handling of collectData.py: isRateLimited, and withBackoff both on its own and
+#  against a local HTTP server standing in for the Graph API (GraphAPI's graph_url and api_url point at it);
+#  and for resumable crawls.
+#
+
+import os
+import json
+import shutil
+import socket
+import tempfile
+import urllib2
+import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+import facebook
+import collectData
+
+
+class FailingCall(object):
+	# Raises each of the given errors in turn, then returns "done"
+	def __init__(self, errors):
+		self.errors = list(errors)
+		self.calls = 0
+
+	def __call__(self):
+		self.calls += 1
+		if self.errors:
+			raise self.errors.pop(0)
+		return "done"
+
+def rateLimited(code=613):
+	return facebook.GraphAPIError({"error_code": code, "error_msg": "Calls to stream have exceeded the rate"})
+
+class IsRateLimitedTest(unittest.TestCase):
+	def testFqlErrorCodes(self):
+		for code in collectData.RATE_LIMIT_ERRORS:
+			self.assertTrue(collectData.isRateLimited(rateLimited(code)))
+		self.assertFalse(collectData.isRateLimited(rateLimited(100)))
+
+	def testGraphErrors(self):
+		error = facebook.GraphAPIError({"error": {"message": "limit", "type": "OAuthException", "code": 17}})
+		self.assertTrue(collectData.isRateLimited(error))
+		error = facebook.GraphAPIError({"error": {"message": "expired", "type": "OAuthException", "code": 190}})
+		self.assertFalse(collectData.isRateLimited(error))
+
+	def testTransientErrors(self):
+		self.assertTrue(collectData.isTransient(rateLimited(2)))
+		self.assertTrue(collectData.isTransient(rateLimited(613)))
+		self.assertFalse(collectData.isRateLimited(rateLimited(2)))
+		self.assertFalse(collectData.isTransient(rateLimited(100)))
+
+	def testOtherResults(self):
+		self.assertFalse(collectData.isRateLimited(facebook.GraphAPIError("not a dict")))
+		self.assertFalse(collectData.isRateLimited(facebook.GraphAPIError({"error": "a string"})))
+
+class WithBackoffTest(unittest.TestCase):
+	def setUp(self):
+		self.delays = []
+		self.sleep = collectData.time.sleep
+		collectData.time.sleep = self.delays.append
+
+	def tearDown(self):
+		collectData.time.sleep = self.sleep
+
+	def testRetriesRateLimits(self):
+		call = FailingCall([rateLimited(), rateLimited(4)])
+		self.assertEqual(collectData.withBackoff(call, delay=1.0), "done")
+		self.assertEqual(call.calls, 3)
+		# exponential, with up to 100% jitter
+		self.assertEqual(len(self.delays), 2)
+		self.assertTrue(1.0 <= self.delays[0] <= 2.0 and 2.0 <= self.delays[1] <= 4.0)
+
+	def testRetriesNetworkErrors(self):
+		call = FailingCall([urllib2.URLError("refused"), socket.error("reset")])
+		self.assertEqual(collectData.withBackoff(call), "done")
+		self.assertEqual(call.calls, 3)
+
+	def testOtherErrorsAreNotRetried(self):
+		call = FailingCall([rateLimited(100)])
+		self.assertRaises(facebook.GraphAPIError, collectData.withBackoff, call)
+		self.assertEqual(call.calls, 1)
+		self.assertEqual(self.delays, [])
+
+	def testGivesUp(self):
+		call = FailingCall([rateLimited()] * 3)
+		self.assertRaises(facebook.GraphAPIError, collectData.withBackoff, call, retries=3)
+		self.assertEqual(call.calls, 3)
+		self.assertEqual(len(self.delays), 2)
+
+class RateLimitedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# Answers FQL queries with a server error while server.unavailable lasts, then with a rate limit error until
+	# server.limited runs out, then with one row
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.server.requests += 1
+		if self.server.unavailable > 0:
+			self.server.unavailable -= 1
+			body = "<html><body>Service Unavailable</body></html>"
+			self.send_response(503)
+			self.send_header("Content-Type", "text/html")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+			return
+		if self.server.limited > 0:
+			self.server.limited -= 1
+			result = {"error_code": 613, "error_msg": "Calls to stream have exceeded the rate of 600 calls per 600 seconds."}
+		else:
+			result = [{"uid": 1, "tv": "Lost"}]
+		body = json.dumps(result)
+		self.send_response(200)
+		self.send_header("Content-Type", "text/javascript; charset=UTF-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+class LocalServerTest(unittest.TestCase):
+	def setUp(self):
+		self.server = LocalServer(("127.0.0.1", 0), RateLimitedHandler)
+		self.server.requests = 0
+		self.server.unavailable = 0
+		self.server.limited = 2
+		threading.Thread(target=self.server.serve_forever).start()
+		base = "http://127.0.0.1:%d/" % self.server.server_address[1]
+		self.graphApi = facebook.GraphAPI("token", timeout=5, graph_url=base, api_url=base + "method/")
+		self.sleep = collectData.time.sleep
+		collectData.time.sleep = lambda seconds: None
+
+	def tearDown(self):
+		collectData.time.sleep = self.sleep
+		self.graphApi.transport.close() # drop the pooled keep-alive connection
+		self.server.shutdown()
+		self.server.server_close()
+
+	def testBacksOffUntilServed(self):
+		result = collectData.withBackoff(lambda: self.graphApi.fql("SELECT tv FROM user WHERE uid = 1"))
+		self.assertEqual(result, [{"uid": 1, "tv": "Lost"}])
+		self.assertEqual(self.server.requests, 3)
+
+	def testRetriesServerErrors(self):
+		self.server.unavailable = 2
+		self.server.limited = 0
+		result = collectData.withBackoff(lambda: self.graphApi.fql("SELECT tv FROM user WHERE uid = 1"))
+		self.assertEqual(result, [{"uid": 1, "tv": "Lost"}])
+		self.assertEqual(self.server.requests, 3)
+
+	def testGivesUp(self):
+		self.server.limited = 10
+		self.assertRaises(facebook.GraphAPIError, collectData.withBackoff,
+			lambda: self.graphApi.fql("SELECT tv FROM user WHERE uid = 1"), 4)
+		self.assertEqual(self.server.requests, 4)
+
+class SimulatedCrash(Exception):
+	pass
+
+class CheckpointTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.output = os.path.join(self.directory, "friendData.xml")
+		self.rename = collectData.os.rename
+
+	def tearDown(self):
+		collectData.os.rename = self.rename
+		shutil.rmtree(self.directory)
+
+	def record(self, userId, version=1):
+		return "\t<user id=\"%s\">\n\t\t<tv>v%d</tv>\n\t</user>\n" % (userId, version)
+
+	def written(self, userIds):
+		# The document a fresh Checkpoint assembles for userIds
+		checkpoint = collectData.Checkpoint(self.output)
+		try:
+			checkpoint.write(self.output, userIds)
+		finally:
+			checkpoint.close()
+		return open(self.output).read()
+
+	def document(self, records):
+		return "<?xml version=\"1.0\"?>\n<users>\n" + "".join(records) + "</users>"
+
+	def leftovers(self):
+		return sorted(name for name in os.listdir(self.directory) if name.endswith(".new"))
+
+	def refreshed(self):
+		# Records for a, b and c, then a second version of a: the records file holds an old copy to compact away
+		checkpoint = collectData.Checkpoint(self.output)
+		for userId in ("a", "b", "c"):
+			checkpoint.append(userId, self.record(userId))
+		checkpoint.append("a", self.record("a", 2))
+		checkpoint.close()
+		return self.document([self.record("a", 2), self.record("b"), self.record("c")])
+
+	def testTornIndexLine(self):
+		checkpoint = collectData.Checkpoint(self.output)
+		checkpoint.append("a", self.record("a"))
+		checkpoint.append("b", self.record("b"))
+		checkpoint.close()
+		# a crash while appending c: its record made it to disk, its index line only partly
+		open(self.output + ".records", "ab").write(self.record("c"))
+		open(self.output + ".checkpoint", "ab").write("c\t1234.5\t")
+		checkpoint = collectData.Checkpoint(self.output)
+		self.assertEqual(sorted(checkpoint.entries), ["a", "b"])
+		self.assertFalse(checkpoint.isFresh("c"))
+		checkpoint.append("c", self.record("c", 2))
+		checkpoint.close()
+		self.assertEqual(len(open(self.output + ".checkpoint").readlines()), 3)
+		self.assertEqual(self.written(["a", "b", "c"]), self.document([self.record("a"), self.record("b"), self.record("c", 2)]))
+
+	def testRefreshThenCompact(self):
+		expected = self.refreshed()
+		checkpoint = collectData.Checkpoint(self.output)
+		checkpoint.close()
+		records = open(self.output + ".records").read()
+		self.assertNotIn(self.record("a"), records)
+		self.assertEqual(len(records), len(expected) - len(self.document([])))
+		self.assertEqual(self.written(["a", "b", "c"]), expected)
+
+	def testFailuresSurviveCompaction(self):
+		self.refreshed()
+		checkpoint = collectData.Checkpoint(self.output)
+		checkpoint.fail("d", facebook.GraphAPIError({"error_code": 100, "error_msg": u"Unsupported\tget request"}))
+		checkpoint.close()
+		checkpoint = collectData.Checkpoint(self.output)
+		self.assertEqual(checkpoint.failures["d"][1], "Unsupported get request")
+		self.assertFalse(checkpoint.isFresh("d"))
+		checkpoint.close()
+
+	def testCrashDuringCompaction(self):
+		# Compaction renames four times: the new records and index into their .new names, then each over the
+		# original. Crash before each one in turn; the next Checkpoint must come up with the latest records.
+		for crashAt in xrange(1, 5):
+			for name in os.listdir(self.directory):
+				os.remove(os.path.join(self.directory, name))
+			expected = self.refreshed()
+			renames = []
+			def rename(source, target):
+				renames.append(target)
+				if len(renames) == crashAt:
+					raise SimulatedCrash()
+				self.rename(source, target)
+			collectData.os.rename = rename
+			self.assertRaises(SimulatedCrash, collectData.Checkpoint, self.output)
+			collectData.os.rename = self.rename
+			self.assertEqual(self.written(["a", "b", "c"]), expected, "crash before rename %d" % crashAt)
+			self.assertEqual(self.leftovers(), [])
+
+class FakeGraphAPI(object):
+	# Serves a profile for every friend, except those in failing, which get the given Graph API error
+	def __init__(self, failing=None):
+		self.failing = failing or {}
+		self.fetched = []
+
+	def get_object(self, id):
+		self.fetched.append(id)
+		if id in self.failing:
+			raise facebook.GraphAPIError({"error_code": self.failing[id], "error_msg": "Service temporarily unavailable"})
+		return {"gender": "female", "locale": "en_US", "favorite_teams": [{"name": u"Team %s" % id}]}
+
+	def fql(self, query):
+		return [{"tv": u"Show %s" % query.split()[-1], "about_me": u"About"}]
+
+class CrawlTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.output = os.path.join(self.directory, "friendData.xml")
+		self.friends = [{"id": str(i)} for i in xrange(10)]
+		self.sleep = collectData.time.sleep
+		collectData.time.sleep = lambda seconds: None
+
+	def tearDown(self):
+		collectData.time.sleep = self.sleep
+		shutil.rmtree(self.directory)
+
+	def users(self):
+		return open(self.output).read().count("<user ")
+
+	def testResumeRetriesFailures(self):
+		graphApi = FakeGraphAPI({"3": 2})
+		collectData.crawl(graphApi, self.friends, self.output)
+		self.assertEqual(graphApi.fetched.count("3"), 6) # retried, as code 2 is transient, then given up
+		self.assertEqual(self.users(), 9)
+		graphApi = FakeGraphAPI()
+		collectData.crawl(graphApi, self.friends, self.output)
+		self.assertEqual(graphApi.fetched, ["3"])
+		self.assertEqual(self.users(), 10)
+
+	def testPermanentErrorsDoNotStopTheCrawl(self):
+		graphApi = FakeGraphAPI({"3": 100, "7": 100})
+		collectData.crawl(graphApi, self.friends, self.output, workers=2, batchSize=1)
+		self.assertEqual(graphApi.fetched.count("3"), 1)
+		self.assertEqual(self.users(), 8)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,7 +1,11 @@
 """
 An implementation of a Collaborative Filtering recommender system. This program
 takes two files as input: Facebook profile data in XML, and a list of stopwords.
-Both user-based as well as item-based methods are implemented.
+Both user-based as well as item-based methods are implemented. With --model, the
+likes and item neighbors are saved as a model artifact (see model_store.py) on the
+first run, and memory-mapped on later ones instead of re-parsing the profile data.
+LikeIndex applies individual like/unlike events to LIKES, LIKED_BY and the item
+neighbors without rebuilding them.
 
 CS 229, Stanford University, Fall 2012
 Author: Samir Bajaj (http://www.samirbajaj.com)
@@ -14,26 +18,17 @@ from __future__ import division
 import re
 import sys
 import math
+import bisect
 import random
-import xml.etree.ElementTree as ET
+import argparse
+import multiprocessing
+import numpy as np
+import scipy.sparse as sp
+import metrics
+import model_store
+import profile_store
 
 
-def tokenize(tvShows, splitter = None):
-    if tvShows is None or tvShows == 'N/A': return []
-    if splitter is None: return tvShows.split()
-    return tvShows.split(splitter)
-
-def normalize(tvShows):
-    if len(tvShows) == 0: return []
-    return [show.strip().lower() for show in tvShows]
-
-def encode(text):
-    if len(text) == 0: return []
-    return [w.encode('utf-8') for w in text]
-    
-def removeStopWords(text, stopwords):
-    return [w for w in text if not w in stopwords]
-
 def filter(regex, text):
     return [w for w in text if not regex.match(w)]
 
@@ -57,23 +52,207 @@ def addItems(LIKES):
             LIKED_BY[show].add(u)
     return LIKED_BY
 
+def itemNeighbors(LIKED_BY, max_neighbors=20):
+    """
+    Precompute the top-K most similar shows for every show, using the cosine
+    between the sets of users who like each show. Returns a map from show id to
+    a list of (neighbor, score) pairs, sorted desc by score.
+    """
+    shows = sorted(LIKED_BY.keys())
+    users = dict()
+    rows = []
+    cols = []
+    for i, show in enumerate(shows):
+        for u in LIKED_BY[show]:
+            rows.append(i)
+            cols.append(users.setdefault(u, len(users)))
+    X = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(shows), len(users)))
+    norms = np.sqrt(np.asarray(X.sum(axis=1)).ravel())
+    common = (X * X.T).tocsr() # number of users who like both shows
+    common.sort_indices() # so that ties come out by show id, as in LikeIndex
+    ITEM_NEIGHBORS = dict()
+    for i, show in enumerate(shows):
+        start, end = common.indptr[i], common.indptr[i + 1]
+        neighbors = common.indices[start:end]
+        scores = common.data[start:end] / (norms[i] * norms[neighbors])
+        scores[neighbors == i] = 0.0 # a show is not its own neighbor
+        best = np.argsort(-scores, kind='mergesort')[:max_neighbors]
+        ITEM_NEIGHBORS[show] = [(shows[neighbors[j]], scores[j]) for j in best if scores[j] > 0.0]
+    return ITEM_NEIGHBORS
+
+class LikeIndex(object):
+    """
+    TV_SHOWS, LIKES and LIKED_BY, kept up to date under add and remove like events,
+    together with the number of users who like each pair of shows, the norm of each
+    show (the square root of its number of fans), and the top max_neighbors item
+    neighbors of each show, as itemNeighbors would compute them from scratch.
+
+    A like of show s by user u only changes the co-occurrence counts of s with the
+    other shows u likes, and the norm of s; so the neighbor list of s is recomputed,
+    and in the list of each show that co-occurs with s only the entry of s is moved.
+    A list is recomputed from scratch only when one of its entries drops out of the
+    top max_neighbors and another show may have to take its place.
+    """
+    def __init__(self, TV_SHOWS, LIKES, max_neighbors=20):
+        self.TV_SHOWS = TV_SHOWS
+        self.LIKES = LIKES
+        self.LIKED_BY = addItems(LIKES)
+        self.max_neighbors = max_neighbors
+        self.next_id = max(TV_SHOWS.values() or [0]) + 1
+        self.norms = dict((show, math.sqrt(len(users))) for (show, users) in self.LIKED_BY.iteritems())
+        self.COMMON = dict((show, dict()) for show in self.LIKED_BY)
+        for likes in LIKES.itervalues():
+            for s in likes:
+                for t in likes:
+                    if s != t: self.COMMON[s][t] = self.COMMON[s].get(t, 0) + 1
+        self.ITEM_NEIGHBORS = dict((show, self.neighborList(show)) for show in self.LIKED_BY)
+
+    def neighborList(self, show):
+        norm = self.norms[show]
+        scores = [(n, c / (norm * self.norms[n])) for (n, c) in self.COMMON[show].iteritems()]
+        scores.sort(key=lambda tup: (-tup[1], tup[0]))
+        return scores[:self.max_neighbors]
+
+    def showId(self, title):
+        """The id of the show with this title, allocating one for a new show."""
+        if title not in self.TV_SHOWS:
+            self.TV_SHOWS[title] = self.next_id
+            self.next_id += 1
+        return self.TV_SHOWS[title]
+
+    def addLike(self, user, title):
+        """Record that user likes the show with this title; returns False if he already did."""
+        show = self.showId(title)
+        likes = self.LIKES.setdefault(user, set())
+        if show in likes: return False
+        if show not in self.LIKED_BY:
+            self.LIKED_BY[show] = set()
+            self.COMMON[show] = dict()
+        for other in likes:
+            self.COMMON[show][other] = self.COMMON[show].get(other, 0) + 1
+            self.COMMON[other][show] = self.COMMON[other].get(show, 0) + 1
+        likes.add(show)
+        self.LIKED_BY[show].add(user)
+        self.refresh(show)
+        return True
+
+    def removeLike(self, user, title):
+        """Record that user no longer likes the show with this title; returns False if he didn't."""
+        show = self.TV_SHOWS.get(title)
+        likes = self.LIKES.get(user, ())
+        if show not in likes: return False
+        likes.remove(show)
+        self.LIKED_BY[show].remove(user)
+        for other in likes:
+            for (a, b) in ((show, other), (other, show)):
+                count = self.COMMON[a][b] - 1
+                if count: self.COMMON[a][b] = count
+                else: del self.COMMON[a][b]
+        if not self.LIKED_BY[show]:
+            # nobody likes it any more: it drops out, as it would from a rebuild
+            del self.LIKED_BY[show], self.COMMON[show], self.norms[show], self.ITEM_NEIGHBORS[show]
+            for other in likes: self.updateNeighbor(other, show)
+        else:
+            self.refresh(show)
+            for other in likes: # those that no longer co-occur with show at all
+                if other not in self.COMMON[show]: self.updateNeighbor(other, show)
+        return True
+
+    def refresh(self, show):
+        """Update the norm of show, and the neighbor lists that depend on it."""
+        self.norms[show] = math.sqrt(len(self.LIKED_BY[show]))
+        self.ITEM_NEIGHBORS[show] = self.neighborList(show)
+        for other in self.COMMON[show]:
+            self.updateNeighbor(other, show)
+
+    def updateNeighbor(self, show, other):
+        """
+        Move other to its place in the neighbor list of show, after their score has
+        changed (or they no longer co-occur). The shows left out of a full list all
+        rank below its last entry, so the list only has to be recomputed when other
+        falls below them and leaves a free place.
+        """
+        neighbors = self.ITEM_NEIGHBORS[show]
+        keys = [(-score, n) for (n, score) in neighbors]
+        last = keys[-1] if keys else None
+        listed = other in [n for (n, score) in neighbors]
+        if listed:
+            i = [n for (score, n) in keys].index(other)
+            del neighbors[i], keys[i]
+        count = self.COMMON[show].get(other)
+        # the number of shows co-occurring with show that were left out of the list
+        left_out = len(self.COMMON[show]) - len(neighbors) - (1 if count else 0)
+        if count:
+            score = count / (self.norms[show] * self.norms[other])
+            if left_out == 0 or (-score, other) <= last:
+                i = bisect.bisect(keys, (-score, other))
+                neighbors.insert(i, (other, score))
+                del neighbors[self.max_neighbors:]
+                return
+        if listed and left_out > 0:
+            self.ITEM_NEIGHBORS[show] = self.neighborList(show)
+
+    def apply(self, events):
+        """Apply a sequence of ('add' | 'remove', user, title) events, in order."""
+        for (action, user, title) in events:
+            if action == 'add': self.addLike(user, title)
+            elif action == 'remove': self.removeLike(user, title)
+            else: raise ValueError("unknown like event: %r" % action)
+
+def itemNeighborArrays(ITEM_NEIGHBORS):
+    """The neighbor lists of all shows, flattened into arrays (see itemNeighborsFromArrays)."""
+    shows = sorted(ITEM_NEIGHBORS.keys())
+    indptr = np.cumsum([0] + [len(ITEM_NEIGHBORS[s]) for s in shows])
+    neighbors = [n for s in shows for (n, score) in ITEM_NEIGHBORS[s]]
+    scores = [score for s in shows for (n, score) in ITEM_NEIGHBORS[s]]
+    return {'shows': np.array(shows, dtype=np.int32), 'indptr': indptr,
+            'neighbors': np.array(neighbors, dtype=np.int32), 'scores': np.array(scores, dtype=np.float32)}
+
+def itemNeighborsFromArrays(arrays):
+    shows, indptr = arrays['shows'].tolist(), arrays['indptr'].tolist()
+    neighbors, scores = arrays['neighbors'].tolist(), arrays['scores'].tolist()
+    return dict((show, zip(neighbors[indptr[i]:indptr[i + 1]], scores[indptr[i]:indptr[i + 1]]))
+                for i, show in enumerate(shows))
+
+def saveItemNeighbors(ITEM_NEIGHBORS, path):
+    np.savez(path, **itemNeighborArrays(ITEM_NEIGHBORS))
+
+def loadItemNeighbors(path):
+    return itemNeighborsFromArrays(np.load(path))
+
+def itemRecommendations(ITEM_NEIGHBORS, liked, max_recos=10):
+    """
+    Merge the precomputed neighbor lists of the shows a user likes: each candidate
+    show scores the sum of its similarities to the liked shows.
+    """
+    scores = dict()
+    for show in sorted(liked): # a fixed summation order, and ties broken by show id, so the
+        for (neighbor, score) in ITEM_NEIGHBORS.get(show, ()): # result doesn't depend on set order
+            if neighbor not in liked: scores[neighbor] = scores.get(neighbor, 0.0) + score
+    return set(sorted(scores, key=lambda show: (-scores[show], show))[:max_recos])
+
 def sample(all, fraction):
     return random.sample(all, int(math.ceil(fraction * len(all))))
 
-def cosine(LIKES, u1, u2):
-    common = LIKES[u1].intersection(LIKES[u2])
-    try:
-        return len(common) / ( math.sqrt(len(LIKES[u1])) * math.sqrt(len(LIKES[u2])) )
-    except ZeroDivisionError as zerr:
-        print LIKES[u1], LIKES[u2]
-        sys.exit(-1)
-
-def neighborhood(LIKES, train_set, u):
-    return dict({(n, cosine(LIKES, u, n)) for n in train_set})
+def neighborhood(LIKES, LIKED_BY, tv_watchers, test_set, u):
+    """
+    Cosine scores of u against the training users who share at least one show
+    with u. Candidates come from the show -> users postings in LIKED_BY, and the
+    overlap counts are accumulated in a single pass over those postings, so users
+    with nothing in common are never scored.
+    """
+    likes = LIKES[u]
+    common = dict()
+    for show in likes:
+        for n in LIKED_BY.get(show, ()):
+            common[n] = common.get(n, 0) + 1
+    norm = math.sqrt(len(likes))
+    return dict((n, c / (norm * math.sqrt(len(LIKES[n])))) for (n, c) in common.iteritems()
+                if n in tv_watchers and n not in test_set)
 
-def knn(LIKES, tv_watchers, test_set, user):
-    neighbors = neighborhood(LIKES, tv_watchers.difference(test_set), user)
-    return sorted([(k, v) for (k, v) in neighbors.iteritems() if v > 0.0], key=lambda tup: -tup[1]) # '-' sign to do reverse sort
+def knn(LIKES, LIKED_BY, tv_watchers, test_set, user):
+    neighbors = neighborhood(LIKES, LIKED_BY, tv_watchers, test_set, user)
+    return sorted([(k, v) for (k, v) in neighbors.iteritems() if v > 0.0], key=lambda tup: (-tup[1], tup[0])) # '-' sign to do reverse sort; ties by id
 
 def recommendations(LIKES, neighborhood, max_neighbors=10):
     recos = set([])
@@ -81,71 +260,193 @@ def recommendations(LIKES, neighborhood, max_neighbors=10):
         recos = recos.union(LIKES[neighbor])
     return recos
 
-def evaluate(LIKES, tv_watchers, test_set, user):
+class HoldoutView(object):
     """
-    For the given test user, temporarily hold back half the TV_SHOWS shows he has watched;
-    then train (compute neighborhood) using the rest of the data. Next, generate
-    recommendations for the test user and see how they compared to the held out set.
+    A read-only view of LIKES in which some of the shows of some users are
+    hidden. Used in place of LIKES during evaluation, so that holding data out
+    never mutates the shared LIKES map, and concurrent trials can share it.
     """
+    def __init__(self, LIKES, held_out):
+        self.LIKES = LIKES
+        self.held_out = held_out # user -> set of hidden shows
+
+    def __getitem__(self, user):
+        if user in self.held_out: return self.LIKES[user].difference(self.held_out[user])
+        return self.LIKES[user]
+
+def holdOut(LIKES, user):
+    """Pick half the TV_SHOWS shows the user has watched, at random, to hold back."""
     sample_size = int(math.ceil(0.5 * len(LIKES[user])))
-    held_out = random.sample( LIKES[user], sample_size )
-    LIKES[user] = LIKES[user].difference(held_out)
-    neighborhood = knn(LIKES, tv_watchers, test_set, user)
-    recos = recommendations(LIKES, neighborhood)
-    if len(recos) == 0: return (0, 0)
-    # precision = fraction of recos that are purchased
-    precision = len(recos.intersection(LIKES[user].union(held_out))) / len(recos)
-    # recall = fraction of purchased items returned by the recommender
-    recall = len(recos.intersection(held_out)) / len(held_out)
-    # restore user's shows
-    LIKES[user] = LIKES[user].union(held_out)
-    return precision, recall
-                                   
+    return set(random.sample( sorted(LIKES[user]), sample_size )) # sorted: set order varies
+
+def heldOutRecommendations(LIKES, LIKED_BY, tv_watchers, test_set, user, held_out):
+    """
+    Train (compute neighborhood) without the user's held out shows, which are hidden
+    through a HoldoutView so LIKES is left untouched, and recommend.
+    """
+    view = HoldoutView(LIKES, {user: held_out})
+    return recommendations(view, knn(view, LIKED_BY, tv_watchers, test_set, user))
+
+# Evaluation state shared with the pool workers. It is filled in before the pool
+# is created, so forked workers inherit it rather than receiving a pickled copy
+# of LIKES with every task.
+_SHARED = dict()
+
+def evaluateShard(task):
+    """
+    Evaluate one shard of one trial's test users and return the summed precision
+    and recall. The shard reseeds the random generator from its own seed, so the
+    result does not depend on which worker runs it, or in what order.
+    """
+    (trial, shard, num_shards, seed) = task
+    LIKES = _SHARED['LIKES']
+    test_users = _SHARED['splits'][trial]
+    test_set = set(test_users)
+    random.seed(seed)
+    users = test_users[shard::num_shards]
+    held_out = []
+    recos = []
+    for u in users:
+        held_out.append(holdOut(LIKES, u))
+        if _SHARED['ITEM_NEIGHBORS']:
+            recos.append(itemRecommendations(_SHARED['ITEM_NEIGHBORS'][trial], LIKES[u].difference(held_out[-1])))
+        else:
+            recos.append(heldOutRecommendations(LIKES, _SHARED['LIKED_BY'], _SHARED['tv_watchers'], test_set, u, held_out[-1]))
+    # grade the whole shard in one go
+    num_shows = _SHARED['num_shows']
+    precision, recall, f1 = metrics.evaluateBatch(metrics.likeMatrix([LIKES[u] for u in users], num_shows),
+                                                  metrics.likeMatrix(held_out, num_shows),
+                                                  metrics.likeMatrix(recos, num_shows))
+    return trial, float(precision.sum()), float(recall.sum())
+
+def evaluateTrials(LIKES, LIKED_BY, tv_watchers, splits, ITEM_NEIGHBORS=None, workers=1, num_shards=64):
+    """
+    Run every trial (a sorted list of test users per trial in splits), sharding the
+    test users of each trial across a pool of worker processes. Returns the mean
+    precision and recall over the trials.
+    """
+    num_shows = max([max(shows) for shows in LIKES.itervalues() if shows] or [0]) + 1
+    _SHARED.update(LIKES=LIKES, LIKED_BY=LIKED_BY, tv_watchers=tv_watchers, splits=splits,
+                   ITEM_NEIGHBORS=ITEM_NEIGHBORS, num_shows=num_shows)
+    tasks = [(trial, shard, num_shards, random.randint(0, sys.maxint))
+             for trial in xrange(len(splits)) for shard in xrange(num_shards)]
+    if workers == 1:
+        results = map(evaluateShard, tasks)
+    else:
+        pool = multiprocessing.Pool(workers or None)
+        try:
+            results = pool.map(evaluateShard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    total_precision = [0.0] * len(splits)
+    total_recall = [0.0] * len(splits)
+    for (trial, precision, recall) in results: # in task order, whatever the schedule
+        total_precision[trial] += precision
+        total_recall[trial] += recall
+    P = sum(total_precision[i]/len(splits[i]) for i in xrange(len(splits)))/len(splits)
+    R = sum(total_recall[i]/len(splits[i]) for i in xrange(len(splits)))/len(splits)
+    return P, R
+
 def parse(fbDataFile, stopwords, UserUser=True):
     TV_SHOWS = {}
     LIKES = {}
     showId = 0
-    tree = ET.parse(fbDataFile)
-    root = tree.getroot()
-    for user in root.findall('user'):
-        userId = None
-        tvShows = None
-        about = None
-        try:
-            userId = user.attrib['id']
-            tvShows = encode( normalize( tokenize(user.find('tv').text, ',') ) )
-        except UnicodeEncodeError as uerr:
-            pass
-        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, tvShows)
+    for (userId, tokens) in profile_store.iterTokens(fbDataFile, stopwords, fields=(profile_store.SHOW_FIELD,)):
+        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, tokens[profile_store.SHOW_FIELD])
     if UserUser: return TV_SHOWS, LIKES
     # Item-Based
     LIKED_BY = addItems(LIKES)
     return TV_SHOWS, LIKED_BY
         
+def buildModel(fbDataFile, stopwords, max_neighbors=20):
+    """
+    Returns TV_SHOWS, LIKES, the users in the order they were read, and the item
+    neighbors of every show, learned from all users.
+    """
+    TV_SHOWS = {}
+    LIKES = {}
+    users = []
+    showId = 0
+    for (userId, tokens) in profile_store.iterTokens(fbDataFile, stopwords, fields=(profile_store.SHOW_FIELD,)):
+        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, tokens[profile_store.SHOW_FIELD])
+        users.append(userId)
+    return TV_SHOWS, LIKES, users, itemNeighbors(addItems(LIKES), max_neighbors)
+
+def saveModel(path, TV_SHOWS, LIKES, users, ITEM_NEIGHBORS, params):
+    shows = [''] + sorted(TV_SHOWS, key=TV_SHOWS.get) # show ids start at 1
+    arrays = {'users': np.array(users, dtype=str), 'shows': np.array(shows, dtype=str),
+              'likes': metrics.likeMatrix([sorted(LIKES[u]) for u in users], len(shows)).astype(np.int8)}
+    for (name, values) in itemNeighborArrays(ITEM_NEIGHBORS).iteritems():
+        arrays['item_' + name] = values
+    model_store.saveModel(path, 'collab', arrays, params)
+
+def loadModel(path):
+    """
+    Load a model saved by saveModel; returns the same values as buildModel. LIKES is
+    filled in the order the users were read, so it iterates in the same order too.
+    """
+    params, arrays = model_store.loadModel(path, 'collab')
+    TV_SHOWS = dict((show, id) for (id, show) in enumerate(arrays['shows'].tolist()) if id > 0)
+    likes = arrays['likes']
+    indptr, indices = likes.indptr.tolist(), likes.indices.tolist()
+    LIKES = dict((u, set(indices[indptr[i]:indptr[i + 1]])) for (i, u) in enumerate(arrays['users'].tolist()))
+    ITEM_NEIGHBORS = itemNeighborsFromArrays(dict((name, arrays['item_' + name]) for name in ('shows', 'indptr', 'neighbors', 'scores')))
+    return TV_SHOWS, LIKES, arrays['users'].tolist(), ITEM_NEIGHBORS
+
 def main(argv):
-    if len(argv) > 1:
-        print "Usage: Recommender.py <fbDataFile.xml>"
-        sys.exit(0)
-    stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/stop_words.txt', 'r').read().strip().split(',') )
-    TV_SHOWS, LIKES = parse(argv[0], stopwords) #, False)    
+    parser = argparse.ArgumentParser(prog='CollabFiltering.py')
+    parser.add_argument('fbDataFile', nargs='?', help='Facebook profile data in XML, or a profile store')
+    parser.add_argument('--model', metavar='DIR',
+                        help='load the likes and item neighbors from this model; built from fbDataFile and saved here if missing')
+    parser.add_argument('--item-based', action='store_true', help='evaluate the item-based recommender')
+    parser.add_argument('--save-items', metavar='FILE', help='precompute item neighbors from all users, save them and exit')
+    parser.add_argument('--neighbors', type=int, default=20, help='neighbors kept per show (item-based)')
+    parser.add_argument('--trials', type=int, default=10, help='number of random train/test splits')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for evaluation (0 = one per core)')
+    parser.add_argument('--seed', type=int, help='random seed, for reproducible evaluations')
+    args = parser.parse_args(argv)
+    params = {'neighbors': args.neighbors}
+    if args.fbDataFile: params.update(model_store.sourceParams(args.fbDataFile))
+    reuse = args.model and model_store.isModel(args.model)
+    changed = model_store.changedParams(args.model, params) if reuse else []
+    if [name for name in changed if name != 'neighbors']:
+        print >> sys.stderr, '%s was built from a different fbDataFile; rebuilding it' % args.model
+        reuse = False
+    if reuse:
+        TV_SHOWS, LIKES, users, ALL_ITEM_NEIGHBORS = loadModel(args.model)
+        if changed:
+            # the likes are all there is to it: recompute the neighbor lists from them
+            print >> sys.stderr, '%s keeps a different number of neighbors; recomputing them' % args.model
+            ALL_ITEM_NEIGHBORS = itemNeighbors(addItems(LIKES), args.neighbors)
+            saveModel(args.model, TV_SHOWS, LIKES, users, ALL_ITEM_NEIGHBORS, dict(model_store.loadParams(args.model), **params))
+    elif args.fbDataFile:
+        stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/stop_words.txt', 'r').read().strip().split(',') )
+        if args.model:
+            TV_SHOWS, LIKES, users, ALL_ITEM_NEIGHBORS = buildModel(args.fbDataFile, stopwords, args.neighbors)
+            saveModel(args.model, TV_SHOWS, LIKES, users, ALL_ITEM_NEIGHBORS, params)
+        else:
+            TV_SHOWS, LIKES = parse(args.fbDataFile, stopwords) #, False)    
+    else:
+        parser.error('fbDataFile is required, unless --model names an existing model')
+    if args.save_items:
+        saveItemNeighbors(itemNeighbors(addItems(LIKES), args.neighbors), args.save_items)
+        return
+    LIKED_BY = addItems(LIKES) # postings used to find candidate neighbors
     #
-    total_precision = 0.0
-    total_recall = 0.0
-    for i in xrange(10):
-        tv_watchers = set([u for u in LIKES.keys() if len(LIKES[u]) > 1]) # 4413 users with two or more TV_SHOWS likes
-        test_set = set(sample(tv_watchers, 0.3))
-        aggr_precision = 0.0
-        aggr_recall = 0.0
-        for u in test_set:
-            (precision, recall) = evaluate(LIKES, tv_watchers, test_set, u)
-            aggr_precision += precision
-            aggr_recall += recall
-        total_precision += aggr_precision/len(test_set)
-        total_recall += aggr_recall/len(test_set)
-    P = total_precision/10
-    R = total_recall/10
+    random.seed(args.seed)
+    tv_watchers = set([u for u in LIKES.keys() if len(LIKES[u]) > 1]) # 4413 users with two or more TV_SHOWS likes
+    splits = [sorted(sample(tv_watchers, 0.3)) for i in xrange(args.trials)]
+    ITEM_NEIGHBORS = None
+    if args.item_based:
+        # item neighborhoods are learned from the users outside each trial's test set
+        ITEM_NEIGHBORS = []
+        for test_users in splits:
+            test_set = set(test_users)
+            train_likes = dict((u, LIKES[u]) for u in LIKES.keys() if u not in test_set)
+            ITEM_NEIGHBORS.append(itemNeighbors(addItems(train_likes), args.neighbors))
+    P, R = evaluateTrials(LIKES, LIKED_BY, tv_watchers, splits, ITEM_NEIGHBORS, args.workers)
     print P, R, (2 * P * R)/(P + R)
 
-
 if __name__ == '__main__':
     main(sys.argv[1:])
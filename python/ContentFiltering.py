@@ -5,7 +5,13 @@ shows, and a list of stopwords. Note that the metadata and Facebook profile data
 should have already been run through the stemmer before being presented to this 
 program. A Porter stemmer is available in porter.py.
 
-Warning: This program takes a very long time to run.
+User vectors are kept as a sparse CSR matrix of (optionally TF-IDF or BM25
+weighted) term counts with unit-length rows, and all test-by-control cosine
+similarities are computed as blocked sparse matrix products; with --ann, the
+neighbors are looked up in an approximate (LSH) index instead, and with --lsa
+the users are compared in a low-dimensional LSA concept space. With --model, the
+user vectors and curated likes are saved as a model artifact (see model_store.py)
+on the first run, and memory-mapped on later ones.
 
 CS 229, Stanford University, Fall 2012
 Author: Samir Bajaj (http://www.samirbajaj.com)
@@ -15,33 +21,26 @@ contribution by including a reference in your work. This is a student research
 project, and no warrantees of any kind are implied.
 """
 from __future__ import division
+import os
 import re
 import sys
+import array
+import argparse
 import math
 import random
+import time
 import numpy as np
-import xml.etree.ElementTree as ET
+import scipy.sparse as sp
+import curated
+import lsh
+import lsa
+import metrics
+import model_store
+import profile_store
+import weighting
+from vocabulary import Vocabulary, TermCounts
 
 
-def tokenize(text, word_re, splitter = None):
-    if text is None or text == 'N/A': return []
-    if splitter is None: return [word_re.search(w).group(0) for w in text.split() if word_re.search(w)]
-    return [word_re.search(w).group(0) for w in text.split(splitter) if word_re.search(w)]
-
-def normalize(tvShows):
-    if len(tvShows) == 0: return []
-    return [show.strip().lower() for show in tvShows]
-
-def encode(text):
-    if len(text) == 0: return []
-    return [w.encode('utf-8') for w in text]
-    
-def removeStopWords(text, stopwords):
-    return [w for w in text if not w in stopwords]
-
-def filter(regex, text):
-    return [w for w in text if not regex.match(w)]
-
 def addTvShows(TV_SHOWS, idSeq, LIKES, userId, tvShows):
     showIds = set()
     for show in tvShows:
@@ -57,115 +56,116 @@ def addTvShows(TV_SHOWS, idSeq, LIKES, userId, tvShows):
 def sample(all, fraction):
     return random.sample(all, int(math.ceil(fraction * len(all))))
 
-def createUserVector(user_words, vocabulary, vocab_size):
-    result = [0] * vocab_size
-    for w in user_words:
-        result[ vocabulary[w] ] += 1
-    return result
-'''
-def cosine(a, b):
-    if len(a) != len(b):
-        raise ValueError, "a and b must be same length"
-    numerator = 0
-    denoma = 0
-    denomb = 0
-    for i in range(len(a)):
-        ai = a[i]             #only calculate once
-        bi = b[i]
-        numerator += ai*bi    #faster than exponent (barely)
-        denoma += ai*ai
-        denomb += bi*bi
-    result = 1 - numerator / (math.sqrt(denoma * denomb))
-    return result
-'''
-
-def cosine(u1, u2):
-    norm1 = np.linalg.norm(u1)
-    norm2 = np.linalg.norm(u2)
-    return np.dot(u1, u2) / ( norm1 * norm2 )
-
-def evaluate(user, LIKES, similar_users):
-    shows_recommended = set()
-    for sim_user in similar_users:
-        shows_recommended.update(LIKES[sim_user])
-    if len(shows_recommended) == 0: return (0, 0)
-    # precision = fraction of shows_recommended that are liked
-    precision = len(shows_recommended.intersection(LIKES[user])) / len(shows_recommended)
-    # recall = fraction of liked items returned by the recommender
-    recall = len(shows_recommended.intersection(LIKES[user])) / len(LIKES[user])
-    return precision, recall
-
-def computeSimilarity(USER_VECTORS, tv_watchers, test_set):
-    control_set = tv_watchers - test_set
-    sim_matrix = dict()
-    for t in test_set:
-        scores = dict() # how similar is user c to user t?
-        for c in control_set:
-            scores[c] = cosine(USER_VECTORS[t], USER_VECTORS[c])
-        # sort desc by scores and take the top 10 similar users
-        sim_matrix[t] = sorted(scores, key=scores.get, reverse=True)[:10]
-    print sim_matrix
-    return sim_matrix            
+def computeSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set, max_neighbors=10, block_size=512):
+    """
+    Cosine similarity of every test user against every control user. The rows of
+    USER_VECTORS (sparse, or dense concept vectors) must already have unit length
+    (see weighting.py and lsa.py), so the scores
+    for a block of test users are just a single sparse matrix product against the
+    (transposed) control matrix; memory stays bounded by block_size x len(control_set).
+    """
+    control_set = list(tv_watchers - test_set)
+    test_users = list(test_set)
+    control_rows = [USER_ROWS[c] for c in control_set]
+    control_t = USER_VECTORS[control_rows].T
+    if sp.issparse(control_t): control_t = control_t.tocsc()
+    top_n = min(max_neighbors, len(control_set))
+    sim_matrix = dict((t, []) for t in test_users)
+    if top_n == 0: return sim_matrix
+    for start in xrange(0, len(test_users), block_size):
+        block = test_users[start:start + block_size]
+        block_rows = [USER_ROWS[t] for t in block]
+        # how similar is user c to user t?
+        scores = USER_VECTORS[block_rows].dot(control_t)
+        if sp.issparse(scores): scores = scores.toarray()
+        # take the top 10 similar users and sort them desc by score
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        for i, t in enumerate(block):
+            best = top[i][np.argsort(-scores[i, top[i]], kind='mergesort')]
+            sim_matrix[t] = [control_set[j] for j in best]
+    return sim_matrix
+
+def approximateSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set, max_neighbors=10, max_candidates=100, seed=None, **index_options):
+    """
+    Like computeSimilarity, but the neighbors of each test user are searched for in a
+    random hyperplane LSH index over the control users (see lsh.py; index_options are
+    passed on to it), so only the control users that share a bucket with him are
+    candidates, and at most max_candidates of them are scored. Returns the sim_matrix,
+    along with the number of candidates found for each test user.
+    """
+    control_set = list(tv_watchers - test_set)
+    test_users = list(test_set)
+    sim_matrix = dict((t, []) for t in test_users)
+    if len(control_set) == 0: return sim_matrix, [0] * len(test_users)
+    index = lsh.HyperplaneIndex(USER_VECTORS[[USER_ROWS[c] for c in control_set]], seed=seed, **index_options)
+    neighbors, scanned = index.query(USER_VECTORS[[USER_ROWS[t] for t in test_users]], max_neighbors, max_candidates)
+    for (t, best) in zip(test_users, neighbors):
+        sim_matrix[t] = [control_set[j] for j in best]
+    return sim_matrix, scanned
+
+def benchmarkSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set, max_candidates=100, seed=None, **index_options):
+    """Time the exact and the approximate neighbor search, and report the recall of the latter."""
+    start = time.time()
+    exact = computeSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set)
+    exact_time = time.time() - start
+    start = time.time()
+    approximate, scanned = approximateSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set,
+                                                 max_candidates=max_candidates, seed=seed, **index_options)
+    approximate_time = time.time() - start
+    found = [len(set(exact[t]).intersection(approximate[t])) / len(exact[t]) for t in exact if exact[t]]
+    num_control = len(tv_watchers - test_set)
+    print 'exact:       %.3fs, %d control users scored per test user' % (exact_time, num_control)
+    print 'approximate: %.3fs, %.1f candidates (%.1f%%) per test user, at most %d scored' % (
+        approximate_time, np.mean(scanned), 100 * np.mean(scanned) / max(num_control, 1), max_candidates)
+    print 'recall@10:   %.4f' % np.mean(found)
                                                
-def parse(fbDataFile, stopwords):
-    word_re = re.compile('\w+') # drop trailing non-alphanumeric chars
+def parse(fbDataFile, stopwords, VOCABULARY):
+    """
+    Returns TV_SHOWS, LIKES and FEATURES, which maps each user to the ids (in
+    VOCABULARY) of the words in his profile.
+    """
     TV_SHOWS = {}
     LIKES = {}
     FEATURES = {}
     showId = 0
-    tree = ET.parse(fbDataFile)
-    root = tree.getroot()
-    for user in root.findall('user'):
-        userId = None
-        tvShows = None
-        about = None
-        movies = None
-        music = None
-        books = None
-        activities = None
-        interests = None
-        try:
-            userId = user.attrib['id']
-            tvShows = removeStopWords( encode( normalize( tokenize(user.find('tv').text, word_re, ',') ) ), stopwords )
-            movies = removeStopWords( encode( normalize( tokenize(user.find('movies').text, word_re, ',') ) ), stopwords )
-            music = removeStopWords( encode( normalize( tokenize(user.find('music').text, word_re, ',') ) ), stopwords )
-            books = removeStopWords( encode( normalize( tokenize(user.find('books').text, word_re, ',') ) ), stopwords )
-            interests = removeStopWords( encode( normalize( tokenize(user.find('interests').text, word_re, ',') ) ), stopwords )
-            if user.find('activities') is not None:
-                activities = removeStopWords( encode( normalize( tokenize(user.find('activities').text, word_re, ',') ) ), stopwords )            
-            about = removeStopWords( encode( normalize( tokenize(user.find('about').text, word_re)) ), stopwords )
-        except UnicodeEncodeError as uerr:
-            pass
-        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, tvShows)
-        FEATURES[userId] = about
-        FEATURES[userId].extend(user.find('gender').text.split())
-        FEATURES[userId].extend(user.find('locale').text.split())
-        FEATURES[userId].extend(movies)
-        FEATURES[userId].extend(books)
-        FEATURES[userId].extend(music)
-        FEATURES[userId].extend(interests)
-        if activities: FEATURES[userId].extend(activities)
+    for (userId, tokens) in profile_store.iterTokens(fbDataFile, stopwords, VOCABULARY.intern):
+        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, [VOCABULARY.terms[t] for t in tokens['tv']])
+        FEATURES[userId] = array.array('i', tokens['about'])
+        FEATURES[userId].extend(tokens['gender'])
+        FEATURES[userId].extend(tokens['locale'])
+        FEATURES[userId].extend(tokens['movies'])
+        FEATURES[userId].extend(tokens['books'])
+        FEATURES[userId].extend(tokens['music'])
+        FEATURES[userId].extend(tokens['interests'])
+        FEATURES[userId].extend(tokens['activities'])
     return TV_SHOWS, LIKES, FEATURES
         
-def main(argv):
-    if len(argv) > 1:
-        print "Usage: Recommender.py <fbDataFile.xml>"
-        sys.exit(0)
-    stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/stop_words.txt', 'r').read().strip().split(',') )
-    TV_SHOWS, LIKES, FEATURES = parse(argv[0], stopwords)
+def lsaRank(lsa_rank, lsa_cache, scheme):
+    """
+    The rank of the concept space buildModel folds the users into (None if it
+    doesn't): lsa_rank if given, else that of a usable lsa_cache, else the default.
+    """
+    if lsa_rank or not lsa_cache: return lsa_rank
+    if os.path.exists(lsa_cache):
+        space = lsa.LatentSpace.load(lsa_cache)
+        if space.matches(None, scheme): return space.fit_rank
+    return 100
+
+def buildModel(fbDataFile, stopwords, scheme='count', lsa_rank=None, lsa_cache=None):
+    """
+    Build everything the recommender needs from the profile data. Returns the users
+    (in row order), their unit-length USER_VECTORS, the CURATED_MATRIX of curated shows
+    each user likes (same rows), the list of tv_watchers, the titles of the curated shows,
+    and the terms (columns) and fitted weighting of the term vectors, to weigh new profiles with.
+    """
+    VOCABULARY = Vocabulary()
+    TV_SHOWS, LIKES, FEATURES = parse(fbDataFile, stopwords, VOCABULARY)
     #
     numbers = re.compile(r'[_\d.]+') # numbers and other strange tokens made up of underscores; re.compile(r'[\d.]*\d+')
-    # Parse TV_SHOWS genre text
-    tv_titles = []
-    tv_genre = []
-    tv_text = []
-    with open('/Users/samir_bajaj/stanford-ml/project/shows_all_stemmed.txt', 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            l = line.strip().split('\t')
-            tv_titles.append( removeStopWords(l[0].split(), stopwords) )
-            tv_genre.append( removeStopWords(l[1].split(), stopwords) )
-            tv_text.append( removeStopWords(l[2].split(), stopwords) )
+    # Parse TV_SHOWS genre text, and index the curated titles by token
+    tv_titles, tv_genre, tv_text = curated.loadCuratedShows('/Users/samir_bajaj/stanford-ml/project/shows_all_stemmed.txt', stopwords)
+    tv_genre_ids = [VOCABULARY.internAll(words) for words in curated.genreWords(tv_genre)]
+    TITLE_INDEX = curated.indexTitles(tv_titles)
     # For content-based filtering, the set of users comprises those who have watched one or more
     # shows from the list for which we have some metadata
     tv_watchers = set()
@@ -182,22 +182,19 @@ def main(argv):
         userCuratedShows = set()
         for showId in LIKES[uid]:
             show_title = inverted[showId].split()
-            FEATURES[uid].extend(show_title)
-            # search through the curated TV_SHOWS show data for a match (or close to a match)
-            for idx, title in enumerate(tv_titles):
-                if len(set(show_title).intersection(title)) > 0:
-                    tv_watchers.add(uid)
-                    key = ''.join(title)
-                    if not key in CURATED_SHOWS:
-                        CURATED_SHOWS[key] = curated_show_id
-                        userCuratedShows.add(curated_show_id)
-                        curated_show_id += 1
-                    else:
-                        userCuratedShows.add(CURATED_SHOWS[key])
-                    # The 'sum' trick below is used to flatten out the list: sum(l, [])
-                    # will flatten a list of lists
-                    FEATURES[uid].extend([w for w in sum([genre.split(',') for genre in tv_genre[idx]], []) if len(w) > 0])
-        FEATURES[uid] = filter(numbers, FEATURES[uid])
+            FEATURES[uid].extend(VOCABULARY.internAll(show_title))
+            # look up the curated TV_SHOWS show data for a match (or close to a match)
+            for idx in curated.matchingShows(TITLE_INDEX, show_title):
+                title = tv_titles[idx]
+                tv_watchers.add(uid)
+                key = ''.join(title)
+                if not key in CURATED_SHOWS:
+                    CURATED_SHOWS[key] = curated_show_id
+                    userCuratedShows.add(curated_show_id)
+                    curated_show_id += 1
+                else:
+                    userCuratedShows.add(CURATED_SHOWS[key])
+                FEATURES[uid].extend(tv_genre_ids[idx])
         CURATED_LIKES[uid] = userCuratedShows
 
     # So we now have the FEATURES map that contains all the stemmed words from the following sources:
@@ -205,31 +202,117 @@ def main(argv):
     #    (ii) The titles of the TV_SHOWS shows liked by the user
     #   (iii) The genre keywords of the TV_SHOWS shows liked (or similar to those liked) by the user
     #
-    all_features = set([])
-    for uid in FEATURES.keys(): all_features.update(FEATURES[uid])
-    all_words = sorted(list(all_features))
-    vocabulary = dict()
-    for idx, word in enumerate(all_words):
-        vocabulary[word] = idx
-
-    USER_VECTORS = dict()
+    # Count the words of each user into compact (term id, count) arrays, leaving out numbers
+    number_ids = VOCABULARY.matching(numbers)
+    USER_TERMS = TermCounts()
     for uid in FEATURES.keys():
-        USER_VECTORS[uid] = createUserVector(FEATURES[uid], vocabulary, len(all_words))
+        USER_TERMS.add(uid, [t for t in FEATURES[uid] if t not in number_ids])
+        del FEATURES[uid] # the counts are all we need from here on
+
+    USER_COUNTS, all_words = USER_TERMS.tocsr(VOCABULARY)
+    # Document frequencies are counted once over all users; the weighted rows have unit
+    # length, so cosine similarity is a plain dot product
+    weights = weighting.Weighting(scheme).fit(USER_COUNTS)
+    USER_VECTORS = weights.transform(USER_COUNTS)
+    if lsa_rank or lsa_cache:
+        # Fold the users into the (cached) concept space; similarities are then computed on
+        # short dense vectors instead of vocabulary-wide sparse ones
+        space = None
+        if lsa_cache and os.path.exists(lsa_cache):
+            space = lsa.LatentSpace.load(lsa_cache)
+            if not space.matches(lsa_rank, scheme):
+                print >> sys.stderr, '%s was fit with a different rank or weighting; refitting it' % lsa_cache
+                space = None
+        if space is None:
+            space = lsa.LatentSpace.fit(USER_VECTORS, all_words, lsa_rank or 100, seed=0, weighting=scheme)
+            if lsa_cache: space.save(lsa_cache)
+        USER_VECTORS = space.project(USER_VECTORS, all_words)
+    users = sorted(USER_TERMS.rows, key=USER_TERMS.rows.get)
+    CURATED_MATRIX = metrics.likeMatrix([CURATED_LIKES[u] for u in users], curated_show_id)
+    curated_titles = [''] * curated_show_id
+    for (idx, title) in enumerate(tv_titles):
+        if ''.join(title) in CURATED_SHOWS: curated_titles[CURATED_SHOWS[''.join(title)]] = ' '.join(title)
+    # in the order they were found, so that set(tv_watchers) always iterates (and samples) the same
+    tv_watchers = [u for u in LIKES.keys() if u in tv_watchers]
+    return users, USER_VECTORS, CURATED_MATRIX, tv_watchers, curated_titles, all_words, weights
+
+def saveModel(path, users, USER_VECTORS, CURATED_MATRIX, tv_watchers, curated_titles, terms, weights, params):
+    vectors = USER_VECTORS if sp.issparse(USER_VECTORS) else np.asarray(USER_VECTORS, dtype=np.float32)
+    params = dict(params, avg_length=weights.avg_length, k1=weights.k1, b=weights.b)
+    model_store.saveModel(path, 'content', {'users': np.array(users, dtype=str), 'vectors': vectors,
+                                            'curated': CURATED_MATRIX, 'tv_watchers': np.array(tv_watchers, dtype=str),
+                                            'curated_titles': np.array(curated_titles, dtype=str),
+                                            'terms': np.array(terms, dtype=str), 'idf': weights.idf}, params)
+
+def loadModel(path):
+    """Memory-map a model saved by saveModel; returns the same values as buildModel."""
+    params, arrays = model_store.loadModel(path, 'content')
+    weights = weighting.Weighting(params['weighting'], params['k1'], params['b'])
+    weights.idf, weights.avg_length = arrays['idf'], params['avg_length']
+    return (arrays['users'].tolist(), arrays['vectors'], arrays['curated'], arrays['tv_watchers'].tolist(),
+            arrays['curated_titles'].tolist(), arrays['terms'].tolist(), weights)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='ContentFiltering.py')
+    parser.add_argument('fbDataFile', nargs='?', help='Facebook profile data in XML, or a profile store')
+    parser.add_argument('--weighting', choices=weighting.SCHEMES, default='count',
+                        help='term weighting of the user vectors (default: raw counts)')
+    parser.add_argument('--lsa', type=int, metavar='RANK', help='compare users in a RANK-dimensional LSA concept space')
+    parser.add_argument('--lsa-cache', metavar='FILE',
+                        help='term -> concept projection to fold the users into; fit and saved here if it does not exist, or was fit with another rank or weighting')
+    parser.add_argument('--ann', action='store_true', help='approximate neighbor search with an LSH index')
+    parser.add_argument('--recall', type=float, default=0.9, help='target recall of the LSH index (with --ann)')
+    parser.add_argument('--min-similarity', type=float, default=0.7,
+                        help='neighbors at least this similar are found with the target recall (with --ann)')
+    parser.add_argument('--bits', type=int, help='LSH signature length (default: sized to the number of users)')
+    parser.add_argument('--bucket-size', type=int, default=32, help='users per LSH bucket the signature length aims for')
+    parser.add_argument('--candidates', type=int, default=100, help='LSH candidates scored exactly per test user')
+    parser.add_argument('--benchmark', action='store_true', help='compare the exact and approximate neighbor searches and exit')
+    parser.add_argument('--model', metavar='DIR',
+                        help='load the users, vectors and curated likes from this model; built from fbDataFile and saved here if missing')
+    args = parser.parse_args(argv)
+    params = {'weighting': args.weighting, 'lsa': lsaRank(args.lsa, args.lsa_cache, args.weighting)}
+    if args.fbDataFile: params.update(model_store.sourceParams(args.fbDataFile))
+    reuse = args.model and model_store.isModel(args.model)
+    if reuse and model_store.changedParams(args.model, params):
+        changed = model_store.describeParams(model_store.changedParams(args.model, params))
+        if not args.fbDataFile:
+            parser.error('%s was built with a different %s; give fbDataFile to rebuild it' % (args.model, changed))
+        print >> sys.stderr, '%s was built with a different %s; rebuilding it' % (args.model, changed)
+        reuse = False
+    if reuse:
+        users, USER_VECTORS, CURATED_MATRIX, tv_watchers, curated_titles, terms, weights = loadModel(args.model)
+    elif args.fbDataFile:
+        stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/stop_words.txt', 'r').read().strip().split(',') )
+        users, USER_VECTORS, CURATED_MATRIX, tv_watchers, curated_titles, terms, weights = buildModel(args.fbDataFile, stopwords, args.weighting, args.lsa, args.lsa_cache)
+        if args.model:
+            saveModel(args.model, users, USER_VECTORS, CURATED_MATRIX, tv_watchers, curated_titles, terms, weights, params)
+    else:
+        parser.error('fbDataFile is required, unless --model names an existing model')
+    USER_ROWS = dict((u, i) for (i, u) in enumerate(users))
+    tv_watchers = set(tv_watchers)
     test_set = set(sample(tv_watchers, 0.3))
     # For each test user, compute the top N=10 users similar to him
-    sim_matrix = computeSimilarity(USER_VECTORS, tv_watchers, test_set)
-    aggr_precision = 0.0
-    aggr_recall = 0.0
-    for u in sim_matrix.keys():
-        (precision, recall) = evaluate(u, CURATED_LIKES, sim_matrix[u])
-        print precision, recall
-        aggr_precision += precision
-        aggr_recall += recall
-    aggr_size = len(sim_matrix.keys())
-    P = aggr_precision/aggr_size
-    R = aggr_recall/aggr_size
-    print P, R, (2 * P * R)/(P + R)
-
+    index_options = dict(recall=args.recall, similarity=args.min_similarity, num_bits=args.bits, bucket_size=args.bucket_size)
+    if args.benchmark:
+        benchmarkSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set, args.candidates, random.randint(0, 2**31 - 1), **index_options)
+        return
+    if args.ann:
+        sim_matrix, scanned = approximateSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set, max_candidates=args.candidates,
+                                                    seed=random.randint(0, 2**31 - 1), **index_options)
+    else:
+        sim_matrix = computeSimilarity(USER_VECTORS, USER_ROWS, tv_watchers, test_set)
+    print sim_matrix
+    # Score all test users at once: each is recommended the curated shows liked by his
+    # similar users, and graded against his own curated shows
+    test_users = sim_matrix.keys()
+    LIKED = CURATED_MATRIX[[USER_ROWS[u] for u in test_users]]
+    RECOS = metrics.neighborRecommendations([sim_matrix[u] for u in test_users], USER_ROWS, CURATED_MATRIX)
+    precision, recall, f1 = metrics.evaluateBatch(LIKED, LIKED, RECOS)
+    for i in xrange(len(test_users)):
+        print float(precision[i]), float(recall[i])
+    P, R, F = metrics.summarize(precision, recall)
+    print P, R, F
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,53 @@
+"""
+Helpers for the curated TV show metadata (shows_all_stemmed.txt): one show per
+line, with tab-separated title, genre and description fields, all stemmed.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+
+
+def removeStopWords(text, stopwords):
+    return [w for w in text if not w in stopwords]
+
+def loadCuratedShows(showsFile, stopwords):
+    tv_titles = []
+    tv_genre = []
+    tv_text = []
+    with open(showsFile, 'r') as f:
+        for line in f:
+            l = line.strip().split('\t')
+            tv_titles.append( removeStopWords(l[0].split(), stopwords) )
+            tv_genre.append( removeStopWords(l[1].split(), stopwords) )
+            tv_text.append( removeStopWords(l[2].split(), stopwords) )
+    return tv_titles, tv_genre, tv_text
+
+def genreWords(tv_genre):
+    """Flatten the comma-separated genre keywords of each show, once per show."""
+    return [[w for genre in genres for w in genre.split(',') if len(w) > 0] for genres in tv_genre]
+
+def indexTitles(tv_titles):
+    """
+    Build an inverted index from each title token to the (ascending) indices of
+    the curated shows whose title contains it.
+    """
+    TITLE_INDEX = dict()
+    for idx, title in enumerate(tv_titles):
+        for token in set(title):
+            TITLE_INDEX.setdefault(token, []).append(idx)
+    return TITLE_INDEX
+
+def matchingShows(TITLE_INDEX, show_title):
+    """
+    Indices of the curated shows that share at least one title token with
+    show_title, in catalog order. Only the postings of show_title's own tokens
+    are visited, rather than the whole catalog.
+    """
+    candidates = set()
+    for token in show_title:
+        candidates.update(TITLE_INDEX.get(token, ()))
+    return sorted(candidates)
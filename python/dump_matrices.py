@@ -1,5 +1,11 @@
 """
-A utility to write out matrices for use by SVD and LSA algorithms.
+A utility to write out matrices for use by SVD and LSA algorithms. The matrices
+are written either as dense space-separated text (the default), or in binary:
+a compressed scipy.sparse .npz file, or a directory of CSR arrays in .npy format
+that downstream jobs can memory-map (see loadMatrix). The binary formats come
+with <name>.rows.txt and <name>.cols.txt, mapping row and column indices back to
+user ids and show titles / terms. factorization.py can fit its SVD and ALS models
+on the binary [user x show] matrix directly.
 
 CS 229, Stanford University, Fall 2012
 Author: Samir Bajaj (http://www.samirbajaj.com)
@@ -8,30 +14,18 @@ You are free to use all or any part of this code, as long as you acknowledge thi
 contribution by including a reference in your work. This is a student research
 project, and no warrantees of any kind are implied.
 """
+import os
 import re
 import sys
-import xml.etree.ElementTree as ET
+import array
+import argparse
+import numpy as np
+import scipy.sparse as sp
+import curated
+import profile_store
+from vocabulary import Vocabulary, TermCounts
 
 
-def tokenize(text, word_re, splitter = None):
-    if text is None or text == 'N/A': return []
-    if splitter is None: return [word_re.search(w).group(0) for w in text.split() if word_re.search(w)]
-    return [word_re.search(w).group(0) for w in text.split(splitter) if word_re.search(w)]
-
-def normalize(tvShows):
-    if len(tvShows) == 0: return []
-    return [show.strip().lower() for show in tvShows]
-
-def encode(text):
-    if len(text) == 0: return []
-    return [w.encode('utf-8') for w in text]
-    
-def removeStopWords(text, stopwords):
-    return [w for w in text if not w in stopwords]
-
-def filter(regex, text):
-    return [w for w in text if not regex.match(w)]
-
 def addTvShows(TV_SHOWS, idSeq, LIKES, userId, tvShows):
     showIds = set()
     for show in tvShows:
@@ -44,71 +38,86 @@ def addTvShows(TV_SHOWS, idSeq, LIKES, userId, tvShows):
     LIKES[userId] = showIds
     return idSeq
 
-def createUserVector(user_words, vocabulary, vocab_size):
-    result = [0] * vocab_size
-    for w in user_words:
-        result[ vocabulary[w] ] += 1
-    return result
+def createLikesMatrix(LIKES, users, num_shows):
+    """Binary [user x show] matrix in CSR form; show id x goes to column x-1."""
+    indptr = [0]
+    indices = []
+    for uid in users:
+        indices.extend(sorted(x - 1 for x in LIKES[uid]))
+        indptr.append(len(indices))
+    return sp.csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(len(users), num_shows))
+
+def writeText(path, matrix, separator, terminator):
+    with open(path, 'w') as f:
+        for i in xrange(matrix.shape[0]):
+            row = matrix.getrow(i).toarray().ravel()
+            f.write(separator.join(map(str, row)))
+            f.write(terminator)
+
+def writeLines(path, items):
+    with open(path, 'w') as f:
+        for item in items:
+            f.write(item)
+            f.write('\n')
+
+def writeMatrix(name, matrix, rows, cols, format):
+    """Write matrix as <name>.npz, or as <name>/{data,indices,indptr,shape}.npy, plus its id maps."""
+    if format == 'npz':
+        sp.save_npz(name + '.npz', matrix)
+    else:
+        if not os.path.isdir(name): os.makedirs(name)
+        for part in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(name, part + '.npy'), getattr(matrix, part))
+        np.save(os.path.join(name, 'shape.npy'), np.array(matrix.shape, dtype=np.int64))
+    writeLines(name + '.rows.txt', rows)
+    writeLines(name + '.cols.txt', cols)
+
+def loadMatrix(name, mmap_mode='r'):
+    """
+    Load a matrix written by writeMatrix. The arrays of the .npy format are
+    memory-mapped, so only the pages actually touched are read from disk.
+    """
+    if os.path.exists(name + '.npz'): return sp.load_npz(name + '.npz')
+    arrays = [np.load(os.path.join(name, part + '.npy'), mmap_mode=mmap_mode) for part in ('data', 'indices', 'indptr')]
+    shape = tuple(np.load(os.path.join(name, 'shape.npy')))
+    return sp.csr_matrix(tuple(arrays), shape=shape, copy=False)
                                                
-def parse(fbDataFile, stopwords):
-    word_re = re.compile('\w+') # drop trailing non-alphanumeric chars
+def parse(fbDataFile, stopwords, VOCABULARY):
+    """
+    Returns TV_SHOWS, LIKES and FEATURES, which maps each user to the ids (in
+    VOCABULARY) of the words in his profile.
+    """
     TV_SHOWS = {}
     LIKES = {}
     FEATURES = {}
     showId = 0
-    tree = ET.parse(fbDataFile)
-    root = tree.getroot()
-    for user in root.findall('user'):
-        userId = None
-        tvShows = None
-        about = None
-        movies = None
-        music = None
-        books = None
-        activities = None
-        interests = None
-        try:
-            userId = user.attrib['id']
-            tvShows = removeStopWords( encode( normalize( tokenize(user.find('tv').text, word_re, ',') ) ), stopwords )
-            movies = removeStopWords( encode( normalize( tokenize(user.find('movies').text, word_re, ',') ) ), stopwords )
-            music = removeStopWords( encode( normalize( tokenize(user.find('music').text, word_re, ',') ) ), stopwords )
-            books = removeStopWords( encode( normalize( tokenize(user.find('books').text, word_re, ',') ) ), stopwords )
-            interests = removeStopWords( encode( normalize( tokenize(user.find('interests').text, word_re, ',') ) ), stopwords )
-            if user.find('activities') is not None:
-                activities = removeStopWords( encode( normalize( tokenize(user.find('activities').text, word_re, ',') ) ), stopwords )            
-            about = removeStopWords( encode( normalize( tokenize(user.find('about').text, word_re)) ), stopwords )
-        except UnicodeEncodeError as uerr:
-            pass
-        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, tvShows)
-        FEATURES[userId] = about
-        FEATURES[userId].extend(user.find('gender').text.split())
-        FEATURES[userId].extend(user.find('locale').text.split())
-        FEATURES[userId].extend(movies)
-        FEATURES[userId].extend(books)
-        FEATURES[userId].extend(music)
-        FEATURES[userId].extend(interests)
-        if activities: FEATURES[userId].extend(activities)
+    for (userId, tokens) in profile_store.iterTokens(fbDataFile, stopwords, VOCABULARY.intern):
+        showId = addTvShows(TV_SHOWS, showId, LIKES, userId, [VOCABULARY.terms[t] for t in tokens['tv']])
+        FEATURES[userId] = array.array('i', tokens['about'])
+        FEATURES[userId].extend(tokens['gender'])
+        FEATURES[userId].extend(tokens['locale'])
+        FEATURES[userId].extend(tokens['movies'])
+        FEATURES[userId].extend(tokens['books'])
+        FEATURES[userId].extend(tokens['music'])
+        FEATURES[userId].extend(tokens['interests'])
+        FEATURES[userId].extend(tokens['activities'])
     return TV_SHOWS, LIKES, FEATURES
         
 def main(argv):
-    if len(argv) > 1:
-        print "Usage: Recommender.py <fbDataFile.xml>"
-        sys.exit(0)
+    parser = argparse.ArgumentParser(prog='dump_matrices.py')
+    parser.add_argument('fbDataFile', help='Facebook profile data in XML, or a profile store')
+    parser.add_argument('--format', choices=('text', 'npz', 'npy'), default='text',
+                        help='dense text (svd.txt, lsa.txt), compressed sparse .npz, or memory-mappable .npy arrays')
+    args = parser.parse_args(argv)
     stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/metadata/stop_words.txt', 'r').read().strip().split(',') )
-    TV_SHOWS, LIKES, FEATURES = parse(argv[0], stopwords)
+    VOCABULARY = Vocabulary()
+    TV_SHOWS, LIKES, FEATURES = parse(args.fbDataFile, stopwords, VOCABULARY)
     #
     numbers = re.compile(r'[_\d.]+') # numbers and other strange tokens made up of underscores; re.compile(r'[\d.]*\d+')
-    # Parse TV_SHOWS genre text
-    tv_titles = []
-    tv_genre = []
-    tv_text = []
-    with open('/Users/samir_bajaj/stanford-ml/project/metadata/shows_all_stemmed.txt', 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            l = line.strip().split('\t')
-            tv_titles.append( removeStopWords(l[0].split(), stopwords) )
-            tv_genre.append( removeStopWords(l[1].split(), stopwords) )
-            tv_text.append( removeStopWords(l[2].split(), stopwords) )
+    # Parse TV_SHOWS genre text, and index the curated titles by token
+    tv_titles, tv_genre, tv_text = curated.loadCuratedShows('/Users/samir_bajaj/stanford-ml/project/metadata/shows_all_stemmed.txt', stopwords)
+    tv_genre_ids = [VOCABULARY.internAll(words) for words in curated.genreWords(tv_genre)]
+    TITLE_INDEX = curated.indexTitles(tv_titles)
     # For content-based filtering, the set of users comprises those who have watched one or more
     # shows from the list for which we have some metadata
     tv_watchers = set()
@@ -125,22 +134,19 @@ def main(argv):
         userCuratedShows = set()
         for showId in LIKES[uid]:
             show_title = inverted[showId].split()
-            FEATURES[uid].extend(show_title)
-            # search through the curated TV_SHOWS show data for a match (or close to a match)
-            for idx, title in enumerate(tv_titles):
-                if len(set(show_title).intersection(title)) > 0:
-                    tv_watchers.add(uid)
-                    key = ''.join(title)
-                    if not key in CURATED_SHOWS:
-                        CURATED_SHOWS[key] = curated_show_id
-                        userCuratedShows.add(curated_show_id)
-                        curated_show_id += 1
-                    else:
-                        userCuratedShows.add(CURATED_SHOWS[key])
-                    # The 'sum' trick below is used to flatten out the list: sum(l, [])
-                    # will flatten a list of lists
-                    FEATURES[uid].extend([w for w in sum([genre.split(',') for genre in tv_genre[idx]], []) if len(w) > 0])
-        FEATURES[uid] = filter(numbers, FEATURES[uid])
+            FEATURES[uid].extend(VOCABULARY.internAll(show_title))
+            # look up the curated TV_SHOWS show data for a match (or close to a match)
+            for idx in curated.matchingShows(TITLE_INDEX, show_title):
+                title = tv_titles[idx]
+                tv_watchers.add(uid)
+                key = ''.join(title)
+                if not key in CURATED_SHOWS:
+                    CURATED_SHOWS[key] = curated_show_id
+                    userCuratedShows.add(curated_show_id)
+                    curated_show_id += 1
+                else:
+                    userCuratedShows.add(CURATED_SHOWS[key])
+                FEATURES[uid].extend(tv_genre_ids[idx])
         CURATED_LIKES[uid] = userCuratedShows
 
     # So we now have the FEATURES map that contains all the stemmed words from the following sources:
@@ -148,36 +154,26 @@ def main(argv):
     #    (ii) The titles of the TV_SHOWS shows liked by the user
     #   (iii) The genre keywords of the TV_SHOWS shows liked (or similar to those liked) by the user
     #
-    all_features = set([])
-    for uid in FEATURES.keys(): all_features.update(FEATURES[uid])
-    all_words = sorted(list(all_features))
-    vocabulary = dict()
-    for idx, word in enumerate(all_words):
-        vocabulary[word] = idx
+    # Count the words of each user into compact (term id, count) arrays, leaving out numbers
+    number_ids = VOCABULARY.matching(numbers)
+    users = LIKES.keys()
+    USER_TERMS = TermCounts()
+    for uid in users:
+        USER_TERMS.add(uid, [t for t in FEATURES[uid] if t not in number_ids])
+        del FEATURES[uid] # the counts are all we need from here on
 
-    USER_VECTORS = dict()
-    for uid in FEATURES.keys():
-        USER_VECTORS[uid] = createUserVector(FEATURES[uid], vocabulary, len(all_words))
+    USER_VECTORS, all_words = USER_TERMS.tocsr(VOCABULARY, dtype=np.int32)
+    USER_LIKES = createLikesMatrix(LIKES, users, len(TV_SHOWS))
     #
     # dump the [user x TV shows] and the [user x term] matrices
     #
-    svd = open('svd.txt', 'w')
-    lsa = open('lsa.txt', 'w')
-    for u in LIKES.keys():
-        ll = ['0']*5892
-        for x in LIKES[u]: ll[x-1] = '1'
-        svd.write(' '.join(ll))
-        svd.write('\n')
-        #
-        for i in range(len(USER_VECTORS[u])):
-            lsa.write(str(USER_VECTORS[u][i]))
-            lsa.write(' ')
-        lsa.write('\n')
-
-    lsa.close()
-    svd.close()
-
-
+    if args.format == 'text':
+        writeText('svd.txt', USER_LIKES, ' ', '\n')
+        writeText('lsa.txt', USER_VECTORS, ' ', ' \n')
+    else:
+        shows = sorted(TV_SHOWS, key=TV_SHOWS.get)
+        writeMatrix('svd', USER_LIKES, users, shows, args.format)
+        writeMatrix('lsa', USER_VECTORS, users, all_words, args.format)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,160 @@
+"""
+Latent factor recommenders fit in-process on the sparse [user x show] like matrix:
+a randomized truncated SVD, and implicit-feedback alternating least squares (ALS).
+Either one yields a matrix of user factors and one of item (show) factors, which
+are saved together with the row and column labels; the predicted preference of a
+user for a show is the dot product of their factors, so scoring a batch of users
+is a single matrix product.
+
+The like matrix is either built directly from the profile data (XML or a profile
+store), or loaded as written by dump_matrices.py (--format npz or npy).
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import os
+import sys
+import random
+import argparse
+import numpy as np
+import scipy.sparse as sp
+import svd
+import metrics
+import dump_matrices
+import CollabFiltering
+
+
+def svdFactors(LIKES_MATRIX, rank=32, seed=None):
+    """User factors U * s and item factors V, so that their product approximates LIKES_MATRIX."""
+    U, s, Vt = svd.randomizedSVD(sp.csr_matrix(LIKES_MATRIX, dtype=np.float64), rank, seed=seed)
+    return U * s, Vt.T.copy()
+
+def alsStep(CONFIDENCE, Y, regularization):
+    """
+    Solve for the factors of every row of CONFIDENCE with Y fixed. Row u weighs the
+    columns it likes by 1 + CONFIDENCE[u] and all the others by 1; only its nonzero
+    entries are visited, on top of the shared Gramian Y'Y.
+    """
+    YtY = Y.T.dot(Y) + regularization * np.eye(Y.shape[1])
+    X = np.zeros((CONFIDENCE.shape[0], Y.shape[1]))
+    indptr, indices, data = CONFIDENCE.indptr, CONFIDENCE.indices, CONFIDENCE.data
+    for u in xrange(CONFIDENCE.shape[0]):
+        start, end = indptr[u], indptr[u + 1]
+        if start == end: continue
+        Yu = Y[indices[start:end]]
+        c = data[start:end]
+        X[u] = np.linalg.solve(YtY + (Yu.T * c).dot(Yu), Yu.T.dot(1 + c))
+    return X
+
+def alsFactors(LIKES_MATRIX, rank=32, regularization=0.1, alpha=40.0, iterations=10, seed=None):
+    """
+    Implicit-feedback ALS (Hu, Koren and Volinsky, 2008): a like is a preference of 1
+    held with confidence 1 + alpha, everything else a preference of 0 with confidence 1.
+    Returns the user and item factors.
+    """
+    CONFIDENCE = sp.csr_matrix(LIKES_MATRIX, dtype=np.float64) * alpha
+    CONFIDENCE_T = CONFIDENCE.T.tocsr()
+    rng = np.random.RandomState(seed)
+    X = rng.normal(scale=0.01, size=(CONFIDENCE.shape[0], rank))
+    Y = rng.normal(scale=0.01, size=(CONFIDENCE.shape[1], rank))
+    for i in xrange(iterations):
+        X = alsStep(CONFIDENCE, Y, regularization)
+        Y = alsStep(CONFIDENCE_T, X, regularization)
+    return X, Y
+
+def recommend(USER_FACTORS, ITEM_FACTORS, LIKED=None, max_recos=10, block_size=1024):
+    """
+    The max_recos best scoring columns for each row of USER_FACTORS, best first,
+    leaving out the columns already liked (the nonzeros of the rows of LIKED).
+    """
+    top_n = min(max_recos, ITEM_FACTORS.shape[0])
+    recos = []
+    for start in xrange(0, USER_FACTORS.shape[0], block_size):
+        scores = USER_FACTORS[start:start + block_size].dot(ITEM_FACTORS.T)
+        if LIKED is not None:
+            rows, cols = LIKED[start:start + block_size].nonzero()
+            scores[rows, cols] = -np.inf
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        for i in xrange(len(scores)):
+            best = top[i][np.argsort(-scores[i, top[i]], kind='mergesort')]
+            recos.append(best[np.isfinite(scores[i, best])].tolist())
+    return recos
+
+def saveFactors(path, USER_FACTORS, ITEM_FACTORS, users, items, method):
+    np.savez(path, users=USER_FACTORS.astype(np.float32), items=ITEM_FACTORS.astype(np.float32),
+             rows=np.array(users, dtype=str), cols=np.array(items, dtype=str), method=method)
+
+def loadFactors(path):
+    """Returns USER_FACTORS, ITEM_FACTORS, and the user ids and show titles they stand for."""
+    model = np.load(path)
+    return model['users'], model['items'], model['rows'].tolist(), model['cols'].tolist()
+
+def loadLikes(path):
+    """
+    The [user x show] like matrix with its user ids and show titles, either built from
+    profile data, or loaded from a matrix written by dump_matrices.py. Show titles are
+    not filtered by stop words, so none are needed.
+    """
+    if os.path.exists(path + '.npz') or os.path.isfile(os.path.join(path, 'indptr.npy')):
+        labels = [open(path + ext).read().splitlines() for ext in ('.rows.txt', '.cols.txt')]
+        return dump_matrices.loadMatrix(path), labels[0], labels[1]
+    TV_SHOWS, LIKES = CollabFiltering.parse(path, set())
+    users = LIKES.keys()
+    return dump_matrices.createLikesMatrix(LIKES, users, len(TV_SHOWS)), users, sorted(TV_SHOWS, key=TV_SHOWS.get)
+
+def factorize(LIKES_MATRIX, args):
+    if args.method == 'svd':
+        return svdFactors(LIKES_MATRIX, args.rank, args.seed)
+    return alsFactors(LIKES_MATRIX, args.rank, args.regularization, args.alpha, args.iterations, args.seed)
+
+def evaluate(LIKES_MATRIX, args):
+    """
+    The protocol of CollabFiltering.py: hold back half the likes (CollabFiltering.holdOut)
+    of 30% of the users with two or more likes, fit on the rest, and grade the top 10
+    recommendations of those users with metrics.evaluateBatch, so the numbers compare
+    with the neighborhood recommenders'.
+    """
+    LIKES_MATRIX = metrics.binary(LIKES_MATRIX)
+    indptr, indices = LIKES_MATRIX.indptr, LIKES_MATRIX.indices
+    LIKES = dict((u, set(indices[indptr[u]:indptr[u + 1]].tolist())) for u in xrange(LIKES_MATRIX.shape[0]))
+    candidates = [u for u in xrange(LIKES_MATRIX.shape[0]) if len(LIKES[u]) > 1]
+    test_users = sorted(CollabFiltering.sample(candidates, 0.3))
+    held_out = [sorted(CollabFiltering.holdOut(LIKES, u)) for u in test_users]
+    rows = [u for (u, shows) in zip(test_users, held_out) for show in shows]
+    cols = [show for shows in held_out for show in shows]
+    HELD_OUT = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=LIKES_MATRIX.shape)
+    TRAIN = LIKES_MATRIX - HELD_OUT
+    TRAIN.eliminate_zeros()
+    USER_FACTORS, ITEM_FACTORS = factorize(TRAIN, args)
+    recos = recommend(USER_FACTORS[test_users], ITEM_FACTORS, TRAIN[test_users])
+    RECOS = metrics.likeMatrix(recos, LIKES_MATRIX.shape[1])
+    precision, recall, f1 = metrics.evaluateBatch(LIKES_MATRIX[test_users], HELD_OUT[test_users], RECOS)
+    return metrics.summarize(precision, recall)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='factorization.py')
+    parser.add_argument('likes', help='Facebook profile data in XML, a profile store, or a like matrix written by dump_matrices.py (e.g. svd)')
+    parser.add_argument('factors', help='where to save the user and item factors (.npz)')
+    parser.add_argument('--method', choices=('svd', 'als'), default='als')
+    parser.add_argument('--rank', type=int, default=32, help='number of latent factors')
+    parser.add_argument('--iterations', type=int, default=10, help='ALS sweeps')
+    parser.add_argument('--regularization', type=float, default=0.1, help='ALS L2 penalty')
+    parser.add_argument('--alpha', type=float, default=40.0, help='ALS confidence of a like')
+    parser.add_argument('--evaluate', action='store_true', help='also report precision/recall on held out likes')
+    parser.add_argument('--seed', type=int, help='random seed, for reproducible runs')
+    args = parser.parse_args(argv)
+    LIKES_MATRIX, users, shows = loadLikes(args.likes)
+    random.seed(args.seed)
+    if args.evaluate:
+        P, R, F = evaluate(LIKES_MATRIX, args)
+        print P, R, F
+    USER_FACTORS, ITEM_FACTORS = factorize(LIKES_MATRIX, args)
+    saveFactors(args.factors, USER_FACTORS, ITEM_FACTORS, users, shows, args.method)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
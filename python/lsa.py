@@ -0,0 +1,78 @@
+"""
+Latent semantic analysis of the [user x term] matrix. A truncated SVD, A ~ U s V',
+gives a term -> concept projection V: a profile with term vector d is represented
+by d V, which for the profiles it was fit on is their row of U s. New profiles are
+folded in the same way, without refitting. The projection is kept together with
+its terms, so it can be saved, loaded, and applied to matrices whose columns are a
+different (e.g. larger) vocabulary, and with the rank and term weighting it was fit
+with, so a saved projection is only reused for the same settings.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import numpy as np
+import scipy.sparse as sp
+import svd
+
+
+class LatentSpace(object):
+    """
+    A term -> concept projection, with the terms its rows stand for, the rank it was
+    asked for (it has fewer concepts if the matrix it was fit on is smaller), and the
+    weighting scheme of the vectors it was fit on.
+    """
+    def __init__(self, terms, PROJECTION, singular_values, fit_rank=None, weighting=None):
+        self.terms = list(terms)
+        self.PROJECTION = PROJECTION
+        self.singular_values = singular_values
+        self.fit_rank = fit_rank or PROJECTION.shape[1]
+        self.weighting = weighting
+
+    @classmethod
+    def fit(cls, VECTORS, terms, rank=100, seed=None, weighting=None):
+        """Fit a rank-dimensional concept space to the rows of VECTORS, whose columns are terms."""
+        U, s, Vt = svd.randomizedSVD(sp.csr_matrix(VECTORS, dtype=np.float64), rank, seed=seed)
+        return cls(terms, Vt.T.copy(), s, rank, weighting)
+
+    @classmethod
+    def load(cls, path):
+        model = np.load(path)
+        # projections saved without their settings match none
+        fit_rank = int(model['fit_rank']) if 'fit_rank' in model.files else -1
+        weighting = str(model['weighting']) if 'weighting' in model.files else None
+        return cls(model['terms'].tolist(), model['projection'], model['singular_values'], fit_rank, weighting)
+
+    def save(self, path):
+        np.savez(path, terms=np.array(self.terms, dtype=str), projection=self.PROJECTION,
+                 singular_values=self.singular_values, fit_rank=self.fit_rank, weighting=str(self.weighting))
+
+    def rank(self):
+        return self.PROJECTION.shape[1]
+
+    def matches(self, rank, weighting):
+        """Whether this space was fit with this rank (None matches any) on vectors weighted by this scheme."""
+        return rank in (None, self.fit_rank) and weighting == self.weighting
+
+    def project(self, VECTORS, terms=None):
+        """
+        Fold the rows of VECTORS into the concept space, as unit-length dense rows
+        (so cosine similarity is a dot product). If the columns of VECTORS are not
+        the terms of the projection, terms names them: terms the projection does not
+        know are ignored.
+        """
+        VECTORS = sp.csr_matrix(VECTORS, dtype=np.float64)
+        if terms is not None and terms != self.terms:
+            known = dict((t, i) for (i, t) in enumerate(self.terms))
+            columns = [(j, known[t]) for (j, t) in enumerate(terms) if t in known]
+            ALIGN = sp.csr_matrix((np.ones(len(columns)), ([j for (j, i) in columns], [i for (j, i) in columns])),
+                                  shape=(len(terms), len(self.terms)))
+            VECTORS = VECTORS * ALIGN
+        CONCEPTS = np.asarray(VECTORS * self.PROJECTION)
+        norms = np.sqrt((CONCEPTS ** 2).sum(axis=1))
+        norms[norms == 0] = 1.0
+        return CONCEPTS / norms[:, np.newaxis]
@@ -0,0 +1,137 @@
+"""
+Approximate nearest neighbor search over unit-length sparse vectors, using random
+hyperplane locality sensitive hashing. Each of a number of hash tables assigns a
+vector a num_bits signature: one bit per random hyperplane, telling which side of
+it the vector lies on. Two vectors at angle theta agree on a bit with probability
+1 - theta / pi, so similar vectors tend to share a bucket in at least one table.
+A query only scores (exactly) the vectors found in its buckets.
+
+The number of tables is derived from the requested recall: a neighbor whose cosine
+similarity with the query is at least `similarity` is found with probability at
+least `recall`.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import math
+import numpy as np
+import scipy.sparse as sp
+
+
+def tablesForRecall(recall, similarity, num_bits):
+    """
+    The number of tables needed for a vector at cosine similarity `similarity` to
+    collide with the query in at least one of them with probability `recall`.
+    """
+    if not 0 < recall < 1:
+        raise ValueError, "recall must be between 0 and 1"
+    collision = (1 - math.acos(max(-1.0, min(1.0, similarity))) / math.pi) ** num_bits
+    if collision >= 1: return 1
+    return max(1, int(math.ceil(math.log(1 - recall) / math.log(1 - collision))))
+
+def bitsForSize(num_vectors, bucket_size=32):
+    """
+    Signature length that splits num_vectors into buckets of about bucket_size
+    vectors each. It grows with log(num_vectors), so the number of vectors a
+    query scans grows sublinearly with the index.
+    """
+    return max(1, min(62, int(round(math.log(max(num_vectors / bucket_size, 1), 2)))))
+
+def expandRanges(starts, ends):
+    """The concatenation of the ranges [starts[i], ends[i]), and the i each element came from."""
+    lengths = ends - starts
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets, owners
+
+class HyperplaneIndex(object):
+    """
+    LSH index over the rows of a sparse matrix whose rows have unit length (so the
+    dot product is the cosine similarity). Build it once with the vectors to be
+    searched, then query() it with a block of vectors at a time. Unless num_bits is
+    given, the signatures are sized to the index (see bitsForSize); the number of
+    tables then follows from the requested recall.
+    """
+    def __init__(self, VECTORS, recall=0.9, similarity=0.5, num_bits=None, bucket_size=32, seed=None):
+        self.VECTORS = sp.csr_matrix(VECTORS)
+        self.num_bits = num_bits or bitsForSize(self.VECTORS.shape[0], bucket_size)
+        self.num_tables = tablesForRecall(recall, similarity, self.num_bits)
+        rng = np.random.RandomState(seed)
+        self.planes = rng.standard_normal((self.VECTORS.shape[1], self.num_tables * self.num_bits)).astype(np.float32)
+        # per table, the row ids sorted by signature, and the sorted signatures
+        self.keys = []
+        self.rows = []
+        for signatures in self.signatures(self.VECTORS).T:
+            order = np.argsort(signatures, kind='mergesort')
+            self.keys.append(signatures[order])
+            self.rows.append(order)
+
+    def signatures(self, VECTORS, block_size=4096):
+        """One num_bits signature (an int64) per row of VECTORS and per table."""
+        VECTORS = sp.csr_matrix(VECTORS, dtype=np.float32)
+        signatures = np.empty((VECTORS.shape[0], self.num_tables), dtype=np.int64)
+        weights = np.int64(1) << np.arange(self.num_bits, dtype=np.int64)
+        for start in xrange(0, VECTORS.shape[0], block_size):
+            bits = np.asarray(VECTORS[start:start + block_size] * self.planes) > 0
+            bits = bits.reshape(-1, self.num_tables, self.num_bits)
+            signatures[start:start + block_size] = (bits * weights).sum(axis=2)
+        return signatures
+
+    def candidates(self, signatures):
+        """
+        The rows sharing a bucket with each query, given the queries' signatures (one
+        row per query): returns the (query, row) pairs, sorted, with the number of
+        tables in which they collide.
+        """
+        queries = []
+        rows = []
+        for (table, keys) in enumerate(self.keys):
+            starts = np.searchsorted(keys, signatures[:, table], 'left')
+            ends = np.searchsorted(keys, signatures[:, table], 'right')
+            positions, owners = expandRanges(starts, ends)
+            rows.append(self.rows[table][positions])
+            queries.append(owners)
+        num_rows = self.VECTORS.shape[0]
+        pairs, collisions = np.unique(np.concatenate(queries) * num_rows + np.concatenate(rows), return_counts=True)
+        return pairs // num_rows, pairs % num_rows, collisions
+
+    def query(self, QUERIES, max_neighbors=10, max_candidates=100, block_size=1024):
+        """
+        The (approximate) max_neighbors most similar rows for each row of QUERIES,
+        most similar first, along with the number of candidate rows found for each
+        query. Similar rows collide with the query in more tables, so only the
+        max_candidates candidates with the most collisions are scored exactly. All
+        the pairs of a block of queries are scored in one vectorised step, and each
+        ranking is a single sort.
+        """
+        QUERIES = sp.csr_matrix(QUERIES)
+        neighbors = []
+        scanned = []
+        for start in xrange(0, QUERIES.shape[0], block_size):
+            BLOCK = QUERIES[start:start + block_size]
+            queries, rows, collisions = self.candidates(self.signatures(BLOCK))
+            scanned.extend(np.bincount(queries, minlength=BLOCK.shape[0]).tolist())
+            # (query, fewest missed tables, row) as one int64, much quicker to sort than three keys
+            num_rows = self.VECTORS.shape[0]
+            order = np.argsort((queries * (self.num_tables + 1) + self.num_tables - collisions) * num_rows + rows)
+            queries, rows = self.firstOfEach(queries, rows, order, max_candidates)
+            scores = np.asarray(BLOCK[queries].multiply(self.VECTORS[rows]).sum(axis=1)).ravel()
+            queries, rows = self.firstOfEach(queries, rows, np.lexsort((rows, -scores, queries)), max_neighbors)
+            bounds = np.searchsorted(queries, np.arange(BLOCK.shape[0] + 1))
+            neighbors.extend(rows[bounds[i]:bounds[i + 1]].tolist() for i in xrange(BLOCK.shape[0]))
+        return neighbors, scanned
+
+    def firstOfEach(self, queries, rows, order, n):
+        """
+        Given the (query, row) pairs and an order that sorts them by query, the first
+        n pairs of each query in that order.
+        """
+        counts = np.bincount(queries)
+        ranks = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+        kept = order[ranks < n]
+        return queries[kept], rows[kept]
@@ -0,0 +1,67 @@
+"""
+Batch precision/recall evaluation of recommendations over sparse [user x show]
+matrices, shared by the content-based and collaborative recommenders.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import numpy as np
+import scipy.sparse as sp
+
+
+def likeMatrix(likes, num_shows):
+    """Binary sparse [user x show] matrix, with one row per set of show ids in likes."""
+    indptr = [0]
+    indices = []
+    for shows in likes:
+        indices.extend(shows)
+        indptr.append(len(indices))
+    return sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(likes), num_shows))
+
+def neighborRecommendations(neighbors, rows, LIKE_MATRIX):
+    """
+    Recommend to each user the union of the shows liked by his neighbors: neighbors
+    holds one list of neighbor ids per user, rows maps ids to rows of LIKE_MATRIX.
+    Computed as a single (user x neighbor) by (neighbor x show) sparse product.
+    """
+    indptr = [0]
+    indices = []
+    for users in neighbors:
+        indices.extend(rows[n] for n in users)
+        indptr.append(len(indices))
+    NEIGHBORS = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(neighbors), LIKE_MATRIX.shape[0]))
+    return NEIGHBORS * LIKE_MATRIX
+
+def binary(matrix):
+    matrix = sp.csr_matrix(matrix, dtype=np.float64, copy=True)
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1.0
+    return matrix
+
+def evaluateBatch(LIKED, HELD_OUT, RECOS):
+    """
+    Per-user precision, recall and F1 for a batch of users, one row each:
+      precision = fraction of the recommended shows (RECOS) that the user likes (LIKED)
+      recall    = fraction of the held out shows (HELD_OUT) that were recommended
+    Users with no recommendations score 0 on all three.
+    """
+    LIKED, HELD_OUT, RECOS = binary(LIKED), binary(HELD_OUT), binary(RECOS)
+    num_recos = np.asarray(RECOS.sum(axis=1)).ravel()
+    num_held_out = np.asarray(HELD_OUT.sum(axis=1)).ravel()
+    hits = np.asarray(RECOS.multiply(LIKED).sum(axis=1)).ravel()
+    held_out_hits = np.asarray(RECOS.multiply(HELD_OUT).sum(axis=1)).ravel()
+    precision = np.where(num_recos > 0, hits / np.maximum(num_recos, 1), 0.0)
+    recall = np.where(num_recos > 0, held_out_hits / np.maximum(num_held_out, 1), 0.0)
+    f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-300), 0.0)
+    return precision, recall, f1
+
+def summarize(precision, recall):
+    """The aggregate numbers the recommenders print: mean precision, mean recall, and their F1."""
+    P = float(precision.mean()) if len(precision) else 0.0
+    R = float(recall.mean()) if len(recall) else 0.0
+    return P, R, (2 * P * R)/(P + R) if P + R > 0 else 0.0
@@ -0,0 +1,105 @@
+"""
+Versioned, self-describing model artifacts, so that the recommenders can save the
+state they build from the profile data (id maps, vocabulary, sparse matrices,
+neighbor tables) once, and memory-map it on later runs instead of rebuilding it.
+
+A model is a directory holding:
+    manifest.json       format version, the kind of model, the parameters it was
+                        built with, and the name, dtype and shape of every array
+    <name>.npy          each dense array
+    <name>.data.npy     each sparse (CSR) matrix, as its three arrays
+    <name>.indices.npy
+    <name>.indptr.npy
+The manifest is written last: a model directory without one is incomplete. All
+arrays are memory-mapped when the model is loaded.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+import os
+import json
+import time
+import numpy as np
+import scipy.sparse as sp
+
+FORMAT = 1
+
+
+def isModel(path):
+    return os.path.isfile(os.path.join(path, 'manifest.json'))
+
+def saveModel(path, kind, arrays, params=None):
+    """
+    Write a model of the given kind (e.g. 'content' or 'collab') to path. arrays maps
+    names to numpy arrays, lists (saved as arrays) or scipy.sparse matrices (saved in
+    CSR form); params is a map of JSON-serializable build parameters.
+    """
+    if not os.path.isdir(path): os.makedirs(path)
+    if isModel(path): os.remove(os.path.join(path, 'manifest.json'))
+    entries = dict()
+    for (name, value) in arrays.iteritems():
+        if sp.issparse(value):
+            value = sp.csr_matrix(value)
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(path, '%s.%s.npy' % (name, part)), getattr(value, part))
+            entries[name] = {'type': 'csr', 'dtype': str(value.dtype), 'shape': list(value.shape)}
+        else:
+            value = np.asarray(value)
+            np.save(os.path.join(path, name + '.npy'), value)
+            entries[name] = {'type': 'dense', 'dtype': str(value.dtype), 'shape': list(value.shape)}
+    manifest = {'format': FORMAT, 'kind': kind, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'params': params or {}, 'arrays': entries}
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def loadParams(path):
+    """The build parameters of the model at path, from its manifest."""
+    return json.load(open(os.path.join(path, 'manifest.json')))['params']
+
+def changedParams(path, params):
+    """The names of the given build parameters that the model at path was built with other values of."""
+    built = loadParams(path)
+    return sorted(name for (name, value) in params.iteritems() if built.get(name) != value)
+
+def sourceParams(path):
+    """
+    Build parameters that identify the data a model is built from: its absolute
+    path, size and modification time (for a directory, such as a profile store,
+    the total size and latest modification time of the files in it).
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+        files = [path]
+    stats = [os.stat(f) for f in files if os.path.isfile(f)]
+    return {'source': os.path.abspath(path), 'source_size': sum(st.st_size for st in stats),
+            'source_mtime': max([st.st_mtime for st in stats] or [0])}
+
+def describeParams(names):
+    """The command line arguments behind the given build parameters, for messages."""
+    return ', '.join(sorted(set('fbDataFile' if name.startswith('source') else '--' + name for name in names)))
+
+def loadModel(path, kind=None):
+    """
+    Memory-map the arrays of the model at path; returns its build parameters, and a
+    map from array name to array (or CSR matrix). If kind is given, the model must
+    be of that kind.
+    """
+    manifest = json.load(open(os.path.join(path, 'manifest.json')))
+    if manifest['format'] != FORMAT:
+        raise ValueError("unsupported model format %r" % manifest['format'])
+    if kind is not None and manifest['kind'] != kind:
+        raise ValueError("%s is a %r model, not %r" % (path, manifest['kind'], kind))
+    arrays = dict()
+    for (name, entry) in manifest['arrays'].iteritems():
+        if entry['type'] == 'csr':
+            parts = [np.load(os.path.join(path, '%s.%s.npy' % (name, part)), mmap_mode='r')
+                     for part in ('data', 'indices', 'indptr')]
+            arrays[name] = sp.csr_matrix(tuple(parts), shape=tuple(entry['shape']), copy=False)
+        else:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+    return manifest['params'], arrays
@@ -27,9 +27,15 @@ to allow word input not restricted to one word per line, leading
 to:
 
 release 2: July 2008
+
+CachedStemmer, at the end of this file, is a front end for stemming large
+volumes of text: it memoizes stems in a bounded LRU cache keyed on the
+surface form, since the same words recur over and over.
 """
 
+import re
 import sys
+from collections import OrderedDict
 
 class PorterStemmer:
 
@@ -344,24 +350,56 @@ class PorterStemmer:
         return self.b[self.k0:self.k+1]
 
 
+class CachedStemmer:
+
+    def __init__(self, maxsize=100000):
+        """A PorterStemmer behind an LRU cache of at most maxsize words.
+        Words must already be in lower case, as for PorterStemmer.stem.
+        """
+        self.stemmer = PorterStemmer()
+        self.maxsize = maxsize
+        self.cache = OrderedDict() # word -> stem, least recently used first
+
+    def stemword(self, word):
+        """stemword(word) returns the stem of a single word."""
+        try:
+            stem = self.cache.pop(word)
+        except KeyError:
+            stem = self.stemmer.stem(word, 0, len(word) - 1)
+            if len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+        self.cache[word] = stem
+        return stem
+
+    def stemwords(self, words):
+        """stemwords(words) stems an iterable of words, lazily, one at a time."""
+        for word in words:
+            yield self.stemword(word)
+
+    def stemlist(self, words):
+        """stemlist(words) stems a whole list of words, looking up (and, on a
+        miss, stemming) each distinct word only once.
+        """
+        stems = dict((word, self.stemword(word)) for word in set(words))
+        return [stems[word] for word in words]
+
+    def stemtext(self, text):
+        """stemtext(text) lower-cases text and replaces every run of letters
+        in it by its stem, leaving all other characters in place.
+        """
+        text = text.lower()
+        words = alpha_re.findall(text)
+        stems = iter(self.stemlist(words))
+        return alpha_re.sub(lambda match: next(stems), text)
+
+alpha_re = re.compile('[a-z]+')
+
+
 if __name__ == '__main__':
-    p = PorterStemmer()
+    p = CachedStemmer()
     if len(sys.argv) > 1:
         for f in sys.argv[1:]:
             infile = open(f, 'r')
-            while 1:
-                output = ''
-                word = ''
-                line = infile.readline()
-                if line == '':
-                    break
-                for c in line:
-                    if c.isalpha():
-                        word += c.lower()
-                    else:
-                        if word:
-                            output += p.stem(word, 0,len(word)-1)
-                            word = ''
-                        output += c.lower()
-                print output,
+            for line in infile:
+                sys.stdout.write(p.stemtext(line))
             infile.close()
@@ -0,0 +1,154 @@
+"""
+A compact, columnar binary store for the Facebook profile data, built once from
+friendData.xml so that the recommenders don't have to re-parse and re-tokenize
+the XML on every run.
+
+A store is a directory holding:
+    meta.json           format version, number of users, and the list of fields
+    users.npy           the (hashed) user ids, one per row
+    vocabulary.npy      the interned tokens of all the text fields
+    shows.npy           the interned TV show titles (the 'shows' field)
+    <field>.ids.npy     for each field, the token ids of all users, concatenated
+    <field>.indptr.npy  ... and the offsets of each user's tokens in <field>.ids.npy
+All arrays are memory-mapped when the store is loaded.
+
+Usage: profile_store.py <fbDataFile.xml> <storeDir>
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+import os
+import re
+import sys
+import json
+import array
+import numpy as np
+import profiles
+from vocabulary import Vocabulary
+
+FORMAT = 1
+# Text fields, tokenized into stemmed words (stop words removed) for content-based filtering
+TEXT_FIELDS = ('tv', 'movies', 'music', 'books', 'interests', 'activities', 'about', 'gender', 'locale')
+# Whole TV show titles, for collaborative filtering
+SHOW_FIELD = 'shows'
+FIELDS = TEXT_FIELDS + (SHOW_FIELD,)
+
+
+word_re = re.compile('\w+') # drop trailing non-alphanumeric chars
+
+def words(text, stopwords, splitter=None, search=word_re.search):
+    """
+    Single pass over text: for each piece (split on splitter, or on whitespace),
+    yield its first run of word characters, lower-cased and utf-8 encoded, unless
+    it is a stop word. No intermediate lists are built.
+    """
+    if text is None or text == 'N/A': return
+    for piece in text.split(splitter):
+        match = search(piece)
+        if match is not None:
+            word = match.group(0).lower().encode('utf-8')
+            if word not in stopwords: yield word
+
+def titles(text):
+    """Yield the whole, normalized, comma-separated titles in text."""
+    if text is None or text == 'N/A': return
+    for title in text.split(','):
+        yield title.strip().lower().encode('utf-8')
+
+def tokenizeUser(fields, stopwords, intern=None, internShow=None, wanted=FIELDS):
+    """
+    Tokenize the raw fields of one <user> element, as read by profiles.iterUsers;
+    only the fields in wanted are tokenized (and returned). If intern (internShow
+    for the show titles) is given, each token is mapped through it as it is
+    produced, e.g. to emit token ids rather than words.
+    """
+    def collect(tokens, intern):
+        if intern is None: return list(tokens)
+        return [intern(w) for w in tokens]
+    tokens = dict((f, []) for f in wanted)
+    try:
+        for f in ('tv', 'movies', 'music', 'books', 'interests', 'activities'):
+            if f in tokens: tokens[f] = collect(words(fields.get(f), stopwords, ','), intern)
+        if 'about' in tokens: tokens['about'] = collect(words(fields.get('about'), stopwords), intern)
+        if SHOW_FIELD in tokens: tokens[SHOW_FIELD] = collect(titles(fields.get('tv')), internShow)
+    except UnicodeEncodeError as uerr:
+        pass
+    if 'gender' in tokens: tokens['gender'] = collect((fields.get('gender') or '').split(), intern)
+    if 'locale' in tokens: tokens['locale'] = collect((fields.get('locale') or '').split(), intern)
+    return tokens
+
+def isStore(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+def iterTokens(path, stopwords, intern=None, fields=FIELDS):
+    """
+    Yield (userId, tokens) for every user, where tokens maps each of the given fields
+    (by default all of FIELDS) to its list of tokens; callers that only need some,
+    e.g. just SHOW_FIELD, save tokenizing the rest. path is either friendData.xml,
+    which is parsed and tokenized on the fly, or a store, whose tokens were computed
+    (with the stop words it was built with) when it was built. If intern is given,
+    the tokens of the text fields come back as intern(word) rather than word, e.g.
+    as ids of a Vocabulary.
+    """
+    if not isStore(path):
+        for (userId, user) in profiles.iterUsers(path):
+            yield userId, tokenizeUser(user, stopwords, intern, wanted=fields)
+        return
+    store = loadStore(path)
+    vocabulary = store['vocabulary'].tolist()
+    if intern is not None: vocabulary = [intern(w) for w in vocabulary]
+    shows = store['shows'].tolist()
+    columns = [(f, store[f + '.indptr'].tolist(), store[f + '.ids'].tolist(),
+                shows if f == SHOW_FIELD else vocabulary) for f in fields]
+    for (i, userId) in enumerate(store['users'].tolist()):
+        yield userId, dict((f, [words[t] for t in ids[indptr[i]:indptr[i + 1]]])
+                           for (f, indptr, ids, words) in columns)
+
+def loadStore(path):
+    """Memory-map all the arrays of a store; returns a map from array name to array."""
+    meta = json.load(open(os.path.join(path, 'meta.json')))
+    if meta['format'] != FORMAT:
+        raise ValueError("unsupported profile store format %r" % meta['format'])
+    names = ['users', 'vocabulary', 'shows'] + [f + part for f in meta['fields'] for part in ('.indptr', '.ids')]
+    return dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r')) for name in names)
+
+def buildStore(fbDataFile, stopwords, path):
+    """Parse and tokenize fbDataFile once, and write the result out as a store at path."""
+    users = []
+    vocabulary = Vocabulary()
+    shows = Vocabulary()
+    columns = dict((f, (array.array('l', [0]), array.array('i'))) for f in FIELDS)
+    for (userId, fields) in profiles.iterUsers(fbDataFile):
+        users.append(userId)
+        # the tokenizer hands back token ids directly
+        tokens = tokenizeUser(fields, stopwords, vocabulary.intern, shows.intern)
+        for f in FIELDS:
+            (indptr, ids) = columns[f]
+            ids.extend(tokens[f])
+            indptr.append(len(ids))
+    if not os.path.isdir(path): os.makedirs(path)
+    def save(name, values, dtype=None):
+        np.save(os.path.join(path, name + '.npy'), np.array(values, dtype=dtype))
+    save('users', users, dtype=str)
+    save('vocabulary', vocabulary.terms, dtype=str)
+    save('shows', shows.terms, dtype=str)
+    for f in FIELDS:
+        save(f + '.indptr', columns[f][0], dtype=np.int64)
+        save(f + '.ids', columns[f][1], dtype=np.int32)
+    # meta.json goes last: a store without it is incomplete
+    json.dump({'format': FORMAT, 'users': len(users), 'fields': list(FIELDS)}, open(os.path.join(path, 'meta.json'), 'w'))
+
+def main(argv):
+    if len(argv) != 2:
+        print "Usage: profile_store.py <fbDataFile.xml> <storeDir>"
+        sys.exit(0)
+    stopwords = set( open('/Users/samir_bajaj/stanford-ml/project/stop_words.txt', 'r').read().strip().split(',') )
+    buildStore(argv[0], stopwords, argv[1])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
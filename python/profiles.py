@@ -0,0 +1,33 @@
+"""
+A streaming reader for the Facebook profile data (friendData.xml) written out by
+fbDataCollector/collectData.py. Shared by the recommenders and dump_matrices.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+
+def iterUsers(fbDataFile):
+    """
+    Yield a (userId, fields) pair for every <user> element in fbDataFile, where
+    fields maps each child tag (tv, movies, about, gender, ...) to its text.
+    The document is read incrementally, and each <user> element is discarded
+    once it has been yielded, so memory use does not grow with the number of
+    profiles.
+    """
+    context = ET.iterparse(fbDataFile, events=('start', 'end'))
+    event, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag != 'user': continue
+        fields = dict((child.tag, child.text) for child in elem)
+        yield elem.attrib.get('id'), fields
+        elem.clear()
+        root.clear() # drop the reference the root still holds to the element
@@ -0,0 +1,357 @@
+"""
+A long-running recommendation server. It loads the model artifacts written by
+CollabFiltering.py and ContentFiltering.py (--model DIR) once, and answers JSON
+queries over a local HTTP endpoint:
+
+    GET /recommend?user=<id>&n=10&method=user|item|content
+        the n best shows for the user: by the shows his most similar users like
+        (user), by the item neighbors of the shows he likes (item), or by the
+        curated shows liked by the users with the most similar profiles (content)
+    GET /similar?user=<id>&n=10&method=likes|content
+        the n users most similar to him, by likes or by profile
+    GET /stats
+        the number of requests served, and their latency percentiles, and the
+        number of requests that failed, by status
+
+Requests are handled on their own threads, but the scoring itself is batched:
+concurrent queries of the same kind are collected for up to a couple of
+milliseconds and scored together, with one sparse matrix product per batch
+(or, for a content model with dense LSA vectors, one product per query). Only
+the stored entries of each row of a product are ranked.
+Every response reports the time it took to serve, in milliseconds.
+
+Usage: server.py [--collab-model DIR] [--content-model DIR] [--port 8000]
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import sys
+import json
+import time
+import Queue
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import numpy as np
+import scipy.sparse as sp
+import model_store
+import weighting
+
+
+def rowTopN(columns, scores, n, exclude=None):
+    """
+    The n highest of the scores of one row (at the given columns), best first and
+    ties by column, as (column, score) pairs; the columns in exclude, and scores of
+    0 or less, are left out.
+    """
+    keep = scores > 0
+    if exclude is not None and len(exclude): keep &= ~np.in1d(columns, exclude)
+    columns, scores = columns[keep], scores[keep]
+    if n <= 0: return []
+    if len(scores) > n:
+        top = np.argpartition(-scores, n - 1)[:n]
+        columns, scores = columns[top], scores[top]
+    return [(int(columns[j]), float(scores[j])) for j in np.lexsort((columns, -scores))]
+
+def topN(SCORES, n, exclude=None):
+    """
+    The columns of the n highest scores in each row of the sparse SCORES, best
+    first, as (column, score) pairs; the nonzeros of exclude, and columns scoring
+    0 or less, are left out. Only the stored entries of each row are ranked, so
+    no row is ever expanded to all the columns.
+    """
+    SCORES = sp.csr_matrix(SCORES)
+    if exclude is not None:
+        exclude = sp.csr_matrix(exclude)
+        exclude.eliminate_zeros()
+    results = []
+    for i in xrange(SCORES.shape[0]):
+        start, end = SCORES.indptr[i], SCORES.indptr[i + 1]
+        excluded = None if exclude is None else exclude.indices[exclude.indptr[i]:exclude.indptr[i + 1]]
+        results.append(rowTopN(SCORES.indices[start:end], SCORES.data[start:end], n, excluded))
+    return results
+
+def selfMatrix(rows, num_users):
+    """Sparse [query x user] matrix with a 1 at each query's own row, rows[i]."""
+    return sp.csr_matrix((np.ones(len(rows)), (np.arange(len(rows)), rows)), shape=(len(rows), num_users))
+
+def neighborWeights(neighbors, num_users):
+    """
+    Sparse [query x user] matrix holding, for each query, the similarities of its
+    neighbors, given as a list of (user, similarity) pairs per query.
+    """
+    indptr = np.cumsum([0] + [len(ns) for ns in neighbors])
+    indices = [j for ns in neighbors for (j, score) in ns]
+    data = [score for ns in neighbors for (j, score) in ns]
+    return sp.csr_matrix((data, indices, indptr), shape=(len(neighbors), num_users))
+
+
+class CollabModel(object):
+    """Serves a model saved by CollabFiltering.py: user-based and item-based recommendations."""
+    def __init__(self, path, max_neighbors=10):
+        params, arrays = model_store.loadModel(path, 'collab')
+        self.users = arrays['users'].tolist()
+        self.rows = dict((u, i) for (i, u) in enumerate(self.users))
+        self.titles = arrays['shows'].tolist()
+        self.LIKES = sp.csr_matrix(arrays['likes'], dtype=np.float64)
+        self.NORMED_LIKES = weighting.normalize(self.LIKES.copy())
+        self.NORMED_LIKES_T = self.NORMED_LIKES.T.tocsr()
+        self.max_neighbors = max_neighbors
+        # the item neighbor lists, as a sparse [show x show] similarity matrix
+        counts = np.diff(arrays['item_indptr'])
+        self.ITEM_SIMILARITY = sp.csr_matrix(
+            (np.asarray(arrays['item_scores'], dtype=np.float64),
+             (np.repeat(arrays['item_shows'], counts), arrays['item_neighbors'])), shape=(len(self.titles),) * 2)
+
+    def recommendUserBased(self, rows, n):
+        WEIGHTS = neighborWeights(self.similarUsers(rows, self.max_neighbors), len(self.users))
+        return topN(WEIGHTS * self.LIKES, n, self.LIKES[rows])
+
+    def recommendItemBased(self, rows, n):
+        LIKED = self.LIKES[rows]
+        return topN(LIKED * self.ITEM_SIMILARITY, n, LIKED)
+
+    def similarUsers(self, rows, n):
+        SIMILARITY = self.NORMED_LIKES[rows] * self.NORMED_LIKES_T
+        return topN(SIMILARITY, n, selfMatrix(rows, len(self.users)))
+
+class ContentModel(object):
+    """Serves a model saved by ContentFiltering.py: similar profiles, and the curated shows they like."""
+    def __init__(self, path, max_neighbors=10):
+        params, arrays = model_store.loadModel(path, 'content')
+        self.users = arrays['users'].tolist()
+        self.rows = dict((u, i) for (i, u) in enumerate(self.users))
+        self.titles = arrays['curated_titles'].tolist()
+        self.VECTORS = arrays['vectors']
+        self.VECTORS_T = self.VECTORS.T.tocsr() if sp.issparse(self.VECTORS) else np.ascontiguousarray(self.VECTORS.T)
+        self.CURATED = sp.csr_matrix(arrays['curated'], dtype=np.float64)
+        self.max_neighbors = max_neighbors
+
+    def recommend(self, rows, n):
+        WEIGHTS = neighborWeights(self.similarUsers(rows, self.max_neighbors), len(self.users))
+        return topN(WEIGHTS * self.CURATED, n, self.CURATED[rows])
+
+    def similarUsers(self, rows, n):
+        if sp.issparse(self.VECTORS):
+            return topN(self.VECTORS[rows].dot(self.VECTORS_T), n, selfMatrix(rows, len(self.users)))
+        # LSA vectors are dense, and so is every row of their product: score one
+        # query at a time rather than the whole [batch x user] block at once
+        columns = np.arange(len(self.users))
+        return [rowTopN(columns, self.VECTORS[row].dot(self.VECTORS_T), n, [row]) for row in rows]
+
+
+class Request(object):
+    """One query waiting in the Batcher's queue."""
+    def __init__(self, function, row, n):
+        self.function = function
+        self.row = row
+        self.n = n
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Batcher(object):
+    """
+    Collects the queries of concurrent request threads, and runs each batch of them
+    through its scoring function in one call: function(rows, n) must return one
+    list of results per row. A batch is closed when it holds max_batch queries,
+    or max_wait seconds after its first one arrived.
+    """
+    def __init__(self, max_batch=64, max_wait=0.002):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def call(self, function, row, n):
+        request = Request(function, row, n)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None: raise request.error
+        return request.result
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0: break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+            groups = dict()
+            for request in batch:
+                groups.setdefault(request.function, []).append(request)
+            for (function, requests) in groups.iteritems():
+                try:
+                    results = function([r.row for r in requests], max(r.n for r in requests))
+                    for (request, result) in zip(requests, results):
+                        request.result = result[:request.n]
+                except Exception as e:
+                    for request in requests: request.error = e
+                for request in requests: request.done.set()
+
+class LatencyStats(object):
+    """
+    The latencies of the last max_samples requests served, per endpoint, and the
+    number of failed requests, per endpoint and status (failures are not timed).
+    """
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = dict()
+        self.counts = dict()
+        self.errors = dict()
+
+    def record(self, endpoint, latency):
+        with self.lock:
+            samples = self.samples.setdefault(endpoint, [])
+            samples.append(latency)
+            if len(samples) > self.max_samples: del samples[:len(samples) - self.max_samples]
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def recordError(self, endpoint, status):
+        with self.lock:
+            errors = self.errors.setdefault(endpoint, dict())
+            errors[str(status)] = errors.get(str(status), 0) + 1
+
+    def summary(self):
+        with self.lock:
+            summary = dict((endpoint, {'requests': self.counts[endpoint],
+                                       'p50_ms': float(np.percentile(samples, 50)),
+                                       'p95_ms': float(np.percentile(samples, 95)),
+                                       'p99_ms': float(np.percentile(samples, 99))})
+                           for (endpoint, samples) in self.samples.iteritems())
+            for (endpoint, errors) in self.errors.iteritems():
+                summary.setdefault(endpoint, {'requests': 0})['errors'] = dict(errors)
+            return summary
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class RecommendationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        start = time.time()
+        url = urlparse.urlparse(self.path)
+        query = dict((k, v[-1]) for (k, v) in urlparse.parse_qs(url.query).iteritems())
+        try:
+            if url.path == '/recommend':
+                response = self.server.recommend(query)
+            elif url.path == '/similar':
+                response = self.server.similar(query)
+            elif url.path == '/stats':
+                response = self.server.stats.summary()
+            else:
+                raise HTTPError(404, 'unknown endpoint: %s' % url.path)
+            status = 200
+        except HTTPError as e:
+            status, response = e.status, {'error': str(e)}
+        except Exception as e:
+            self.log_error('error serving %s: %r', self.path, e)
+            status, response = 500, {'error': 'internal error'}
+        latency = (time.time() - start) * 1000
+        if url.path in ('/recommend', '/similar'):
+            if status == 200: self.server.stats.record(url.path, latency)
+            else: self.server.stats.recordError(url.path, status)
+            response['latency_ms'] = latency
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet: BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def log_error(self, format, *args):
+        BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args) # even when quiet
+
+class RecommendationServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # the listen() backlog; the default of 5 drops connections under bursts
+
+    def __init__(self, address, collab=None, content=None, batcher=None, quiet=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RecommendationHandler)
+        self.collab = collab
+        self.content = content
+        self.batcher = batcher or Batcher()
+        self.stats = LatencyStats()
+        self.quiet = quiet
+
+    def lookup(self, query, methods):
+        """The model, scoring function (by query's method) and row of the user named in query, and n."""
+        if 'user' not in query: raise HTTPError(400, 'missing parameter: user')
+        method = query['method']
+        if method not in methods: raise HTTPError(400, 'unknown method: %s' % method)
+        (model, function) = methods[method]
+        if model is None: raise HTTPError(404, 'no model loaded for method: %s' % method)
+        if query['user'] not in model.rows: raise HTTPError(404, 'unknown user: %s' % query['user'])
+        try:
+            n = int(query.get('n', 10))
+        except ValueError:
+            raise HTTPError(400, 'n must be an integer')
+        if not 0 < n <= 1000: raise HTTPError(400, 'n must be between 1 and 1000')
+        return model, getattr(model, function), model.rows[query['user']], n
+
+    def recommend(self, query):
+        if 'method' not in query: query['method'] = 'user' if self.collab is not None else 'content'
+        model, function, row, n = self.lookup(query, {'user': (self.collab, 'recommendUserBased'),
+                                                      'item': (self.collab, 'recommendItemBased'),
+                                                      'content': (self.content, 'recommend')})
+        shows = self.batcher.call(function, row, n)
+        return {'user': query['user'], 'method': query['method'],
+                'shows': [{'title': model.titles[j], 'score': score} for (j, score) in shows]}
+
+    def similar(self, query):
+        if 'method' not in query: query['method'] = 'likes' if self.collab is not None else 'content'
+        model, function, row, n = self.lookup(query, {'likes': (self.collab, 'similarUsers'),
+                                                      'content': (self.content, 'similarUsers')})
+        users = self.batcher.call(function, row, n)
+        return {'user': query['user'], 'method': query['method'],
+                'users': [{'user': model.users[j], 'score': score} for (j, score) in users]}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='server.py')
+    parser.add_argument('--collab-model', metavar='DIR', help='model saved by CollabFiltering.py --model')
+    parser.add_argument('--content-model', metavar='DIR', help='model saved by ContentFiltering.py --model')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--neighbors', type=int, default=10, help='similar users to recommend from')
+    parser.add_argument('--max-batch', type=int, default=64, help='most queries scored together')
+    parser.add_argument('--max-wait', type=float, default=2.0, help='milliseconds to wait for a batch to fill up')
+    parser.add_argument('--quiet', action='store_true', help="don't log every request")
+    args = parser.parse_args(argv)
+    if not args.collab_model and not args.content_model:
+        parser.error('at least one of --collab-model and --content-model is required')
+    collab = CollabModel(args.collab_model, args.neighbors) if args.collab_model else None
+    content = ContentModel(args.content_model, args.neighbors) if args.content_model else None
+    server = RecommendationServer((args.host, args.port), collab, content,
+                                  Batcher(args.max_batch, args.max_wait / 1000), args.quiet)
+    print "Serving on http://%s:%d/" % (args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
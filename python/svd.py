@@ -0,0 +1,29 @@
+"""
+Randomized truncated SVD of a sparse matrix, shared by the latent factor
+recommenders (factorization.py) and latent semantic analysis (lsa.py). It only
+depends on numpy, so that neither of them pulls in the other's dependencies.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+import numpy as np
+
+
+def randomizedSVD(A, rank, oversample=10, iterations=4, seed=None):
+    """
+    The leading rank singular triplets (U, s, Vt) of the sparse matrix A, found by
+    randomized range finding with a few power iterations (Halko et al., 2011).
+    """
+    rng = np.random.RandomState(seed)
+    k = min(rank + oversample, min(A.shape))
+    Q, _ = np.linalg.qr(A.dot(rng.standard_normal((A.shape[1], k))))
+    for i in xrange(iterations):
+        Q, _ = np.linalg.qr(A.T.dot(Q))
+        Q, _ = np.linalg.qr(A.dot(Q))
+    B = np.asarray(A.T.dot(Q)).T
+    Ub, s, Vt = np.linalg.svd(B, full_matrices=False)
+    return Q.dot(Ub)[:, :rank], s[:rank], Vt[:rank]
@@ -0,0 +1,55 @@
+"""
+Tests for CollabFiltering.LikeIndex: the item neighbor lists kept up to date under
+like events must be the ones a rebuild from the resulting likes computes.
+"""
+import random
+import unittest
+import CollabFiltering
+
+
+def randomLikes(rng, num_users, num_shows, likes_per_user):
+    TV_SHOWS = dict(('show %d' % i, i) for i in xrange(num_shows))
+    LIKES = dict()
+    for u in xrange(num_users):
+        LIKES['user %d' % u] = set(rng.sample(xrange(num_shows), rng.randint(1, likes_per_user)))
+    return TV_SHOWS, LIKES
+
+def randomEvents(rng, LIKES, num_shows, num_events):
+    """Add and remove events, with some for shows and users the index has never seen."""
+    events = []
+    for i in xrange(num_events):
+        user = 'user %d' % rng.randint(0, len(LIKES) + 5)
+        title = 'show %d' % rng.randint(0, num_shows + 3)
+        events.append((rng.choice(('add', 'remove', 'remove')), user, title))
+    return events
+
+class LikeIndexTest(unittest.TestCase):
+    def assertRebuilt(self, index):
+        rebuilt = CollabFiltering.LikeIndex(dict(index.TV_SHOWS), dict((u, set(l)) for (u, l) in index.LIKES.iteritems()),
+                                            index.max_neighbors)
+        self.assertEqual(rebuilt.ITEM_NEIGHBORS, index.ITEM_NEIGHBORS)
+        self.assertEqual(rebuilt.COMMON, index.COMMON)
+
+    def testIncrementalMatchesRebuild(self):
+        for seed in xrange(5):
+            rng = random.Random(seed)
+            TV_SHOWS, LIKES = randomLikes(rng, 60, 30, 6)
+            index = CollabFiltering.LikeIndex(TV_SHOWS, LIKES, max_neighbors=5)
+            for event in randomEvents(rng, LIKES, 30, 400):
+                index.apply([event])
+            self.assertRebuilt(index)
+
+    def testEveryEvent(self):
+        rng = random.Random(11)
+        TV_SHOWS, LIKES = randomLikes(rng, 20, 12, 4)
+        index = CollabFiltering.LikeIndex(TV_SHOWS, LIKES, max_neighbors=3)
+        for event in randomEvents(rng, LIKES, 12, 150):
+            index.apply([event])
+            self.assertRebuilt(index)
+
+    def testUnknownEvent(self):
+        index = CollabFiltering.LikeIndex({}, {})
+        self.assertRaises(ValueError, index.apply, [('like', 'user', 'show')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Interned term vocabulary, and compact per-user term counts that convert straight
+into a sparse [user x term] matrix.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+import array
+import numpy as np
+import scipy.sparse as sp
+
+
+class Vocabulary(object):
+    """
+    Maps terms (words) to consecutive integer ids, in order of first appearance.
+    Pass intern() to the tokenizer to get ids instead of words.
+    """
+    def __init__(self, terms=()):
+        self.ids = dict()
+        self.terms = []
+        for term in terms: self.intern(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.ids
+
+    def intern(self, term):
+        try:
+            return self.ids[term]
+        except KeyError:
+            self.ids[term] = len(self.terms)
+            self.terms.append(term)
+            return self.ids[term]
+
+    def internAll(self, terms):
+        return array.array('i', [self.intern(term) for term in terms])
+
+    def matching(self, regex):
+        """The set of ids of the terms that regex matches."""
+        return set(id for (id, term) in enumerate(self.terms) if regex.match(term))
+
+
+class TermCounts(object):
+    """
+    The term counts of each user, as (term_id, count) pairs sorted by term id, kept
+    in flat typed buffers. This is exactly the layout of a CSR matrix, and tocsr()
+    hands the buffers over as one.
+    """
+    def __init__(self):
+        self.rows = dict() # user id -> row
+        self.indptr = array.array('l', [0])
+        self.indices = array.array('i')
+        self.counts = array.array('i')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, userId, termIds):
+        ids, counts = np.unique(np.asarray(termIds, dtype=np.int32), return_counts=True)
+        self.rows[userId] = len(self.rows)
+        self.indices.fromstring(ids.astype(np.int32).tostring())
+        self.counts.fromstring(counts.astype(np.int32).tostring())
+        self.indptr.append(len(self.indices))
+
+    def tocsr(self, vocabulary, dtype=np.float64):
+        """
+        Returns the [user x term] count matrix, and the terms of its columns: only
+        the terms that occur are kept, in sorted order.
+        """
+        indices = np.frombuffer(self.indices, dtype=np.int32)
+        used = np.unique(indices)
+        terms = sorted(vocabulary.terms[id] for id in used)
+        columns = np.zeros(len(vocabulary), dtype=np.int32)
+        columns[[vocabulary.ids[term] for term in terms]] = np.arange(len(terms), dtype=np.int32)
+        data = np.frombuffer(self.counts, dtype=np.int32).astype(dtype)
+        indptr = np.frombuffer(self.indptr, dtype=np.dtype('l'))
+        matrix = sp.csr_matrix((data, columns[indices], indptr), shape=(len(self.rows), len(terms)))
+        matrix.sort_indices() # columns were renumbered
+        return matrix, terms
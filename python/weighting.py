@@ -0,0 +1,78 @@
+"""
+Term weighting for the sparse [user x term] count matrices: raw counts, TF-IDF,
+sublinear TF-IDF and BM25. Document frequencies are counted once, when the
+weighting is fit, and the IDF vector is kept so that new profiles can be weighted
+the same way. Weighted rows are L2-normalised, so the cosine similarity of two
+users is just the dot product of their rows.
+
+CS 229, Stanford University, Fall 2012
+Author: Samir Bajaj (http://www.samirbajaj.com)
+
+You are free to use all or any part of this code, as long as you acknowledge this
+contribution by including a reference in your work. This is a student research
+project, and no warrantees of any kind are implied.
+"""
+from __future__ import division
+import numpy as np
+import scipy.sparse as sp
+
+SCHEMES = ('count', 'tfidf', 'sublinear', 'bm25')
+
+
+def normalize(matrix):
+    """Scale each row of a CSR matrix to unit L2 norm, in place; empty rows stay empty."""
+    norms = np.sqrt(np.bincount(np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr)),
+                                weights=matrix.data ** 2, minlength=matrix.shape[0]))
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+class Weighting(object):
+    """
+    Weights a [user x term] count matrix by one of SCHEMES:
+      count     - the raw term counts
+      tfidf     - count * idf
+      sublinear - (1 + log(count)) * idf
+      bm25      - count * (k1 + 1) / (count + k1 * (1 - b + b * length / avg_length)) * idf
+    where idf = log((1 + N) / (1 + df)) + 1, or the BM25 idf for bm25, for N users
+    of which df use the term. Call fit() once on the full matrix; transform() can
+    then be applied to it and to any other rows over the same terms.
+    """
+    def __init__(self, scheme='tfidf', k1=1.2, b=0.75):
+        if scheme not in SCHEMES:
+            raise ValueError, "unknown weighting scheme: %s" % scheme
+        self.scheme = scheme
+        self.k1 = k1
+        self.b = b
+        self.idf = None
+        self.avg_length = None
+
+    def fit(self, COUNTS):
+        COUNTS = sp.csr_matrix(COUNTS)
+        num_users = COUNTS.shape[0]
+        df = np.bincount(COUNTS.indices, minlength=COUNTS.shape[1]).astype(np.float64)
+        if self.scheme == 'bm25':
+            self.idf = np.log(1 + (num_users - df + 0.5) / (df + 0.5))
+        else:
+            self.idf = np.log((1 + num_users) / (1 + df)) + 1
+        self.avg_length = max(COUNTS.sum() / max(num_users, 1), 1e-12)
+        return self
+
+    def transform(self, COUNTS):
+        """Returns the weighted, row-normalised copy of COUNTS (a new CSR matrix)."""
+        if self.idf is None:
+            raise ValueError, "transform() called before fit()"
+        WEIGHTS = sp.csr_matrix(COUNTS, dtype=np.float64, copy=True)
+        WEIGHTS.sum_duplicates()
+        tf = WEIGHTS.data
+        if self.scheme == 'sublinear':
+            tf[:] = 1 + np.log(tf)
+        elif self.scheme == 'bm25':
+            lengths = np.repeat(np.asarray(WEIGHTS.sum(axis=1)).ravel(), np.diff(WEIGHTS.indptr))
+            tf[:] = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / self.avg_length))
+        if self.scheme != 'count':
+            tf *= self.idf[WEIGHTS.indices]
+        return normalize(WEIGHTS)
+
+    def fitTransform(self, COUNTS):
+        return self.fit(COUNTS).transform(COUNTS)